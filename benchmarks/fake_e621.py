@@ -0,0 +1,247 @@
+"""A local stand-in for the parts of e621 that yippi_dl talks to.
+
+Run it on its own with ``python -m benchmarks.fake_e621 --help``.
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import random
+
+from aiohttp import web
+
+BLOCK = os.urandom(64 * 1024)
+
+
+class FakeE621:
+    def __init__(
+        self,
+        posts=1000,
+        file_size=256 * 1024,
+        latency=0.0,
+        bandwidth=0,
+        error_rate=0.0,
+        error_status=503,
+        pool_size=25,
+        static_host="localhost",
+    ):
+        self.posts = posts
+        self.file_size = file_size
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.pool_size = pool_size
+        self.static_host = static_host
+        self.port = None
+        self.md5s = {}
+        self.by_md5 = {}
+        self.random = random.Random(0)
+
+    def content(self, post_id):
+        # Cheap to produce at any size, and unique per post.
+        header = post_id.to_bytes(8, "big")
+        size = self.file_size - len(header)
+        body = BLOCK * (size // len(BLOCK) + 1)
+        return header + body[:size]
+
+    def md5(self, post_id):
+        if post_id not in self.md5s:
+            md5 = hashlib.md5(self.content(post_id)).hexdigest()
+            self.md5s[post_id] = md5
+            self.by_md5[md5] = post_id
+        return self.md5s[post_id]
+
+    def post_json(self, post_id):
+        md5 = self.md5(post_id)
+        host = f"http://{self.static_host}:{self.port}"
+        file = {
+            "width": 100,
+            "height": 100,
+            "ext": "png",
+            "size": self.file_size,
+            "md5": md5,
+            "url": f"{host}/data/{md5[:2]}/{md5[2:4]}/{md5}.png",
+        }
+        return {
+            "id": post_id,
+            "created_at": "2020-01-01T00:00:00.000-00:00",
+            "updated_at": "2020-01-01T00:00:00.000-00:00",
+            "file": file,
+            "preview": dict(file),
+            "sample": dict(file),
+            "score": {"up": 1, "down": 0, "total": 1},
+            "tags": {"general": ["benchmark"]},
+            "rating": "s",
+            "sources": [],
+            "pools": [self.pool_of(post_id)],
+            "description": "",
+        }
+
+    def pool_of(self, post_id):
+        return (post_id - 1) // self.pool_size + 1
+
+    def pool_ids(self, pool_id):
+        first = (pool_id - 1) * self.pool_size + 1
+        last = min(first + self.pool_size, self.posts + 1)
+        return list(range(first, last))
+
+    def search(self, tags):
+        ids = range(self.posts, 0, -1)
+        for tag in tags.split():
+            if tag.startswith("id:>"):
+                ids = [i for i in ids if i > int(tag[4:])]
+            elif tag.startswith("id:"):
+                wanted = {int(i) for i in tag[3:].split(",")}
+                ids = [i for i in ids if i in wanted]
+            elif tag.startswith("pool:"):
+                ids = [i for i in ids if self.pool_of(i) == int(tag[5:])]
+        return list(ids)
+
+    async def delay(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def fail(self):
+        if self.error_rate and self.random.random() < self.error_rate:
+            headers = {"Retry-After": "1"}
+            return web.Response(status=self.error_status, headers=headers)
+
+    async def handle_posts(self, request):
+        await self.delay()
+        query = request.query
+        ids = self.search(query.get("tags", ""))
+        limit = int(query.get("limit", 75))
+        page = query.get("page", "1")
+        if page.startswith("b"):
+            ids = [i for i in ids if i < int(page[1:])][:limit]
+        elif page.startswith("a"):
+            ids = [i for i in ids if i > int(page[1:])][-limit:]
+        else:
+            start = (int(page) - 1) * limit
+            ids = ids[start : start + limit]
+        return web.json_response({"posts": [self.post_json(i) for i in ids]})
+
+    async def handle_post(self, request):
+        await self.delay()
+        post_id = int(request.match_info["id"])
+        if not 0 < post_id <= self.posts:
+            return web.json_response({"reason": "not found"}, status=404)
+        return web.json_response({"post": self.post_json(post_id)})
+
+    def pool_json(self, pool_id):
+        post_ids = self.pool_ids(pool_id)
+        if post_ids:
+            return {
+                "id": pool_id,
+                "name": f"Benchmark_pool_{pool_id}",
+                "created_at": "2020-01-01T00:00:00.000-00:00",
+                "updated_at": "2020-01-01T00:00:00.000-00:00",
+                "creator_id": 1,
+                "creator_name": "benchmark",
+                "description": "",
+                "is_active": True,
+                "is_deleted": False,
+                "category": "series",
+                "post_ids": post_ids,
+                "post_count": len(post_ids),
+            }
+
+    async def handle_pool(self, request):
+        await self.delay()
+        pool = self.pool_json(int(request.match_info["id"]))
+        if not pool:
+            return web.json_response({"reason": "not found"}, status=404)
+        return web.json_response(pool)
+
+    async def handle_pools(self, request):
+        await self.delay()
+        ids = request.query.get("search[id]", "")
+        pools = [self.pool_json(int(i)) for i in ids.split(",") if i]
+        return web.json_response([pool for pool in pools if pool])
+
+    async def handle_file(self, request):
+        failure = self.fail()
+        if failure:
+            return failure
+
+        post_id = self.by_md5.get(request.match_info["md5"])
+        if post_id is None:
+            return web.Response(status=404)
+
+        content = self.content(post_id)
+        start = 0
+        status = 200
+        headers = {}
+        range_header = request.headers.get("Range")
+        if range_header:
+            start = int(range_header.split("=")[1].split("-")[0])
+            if start >= len(content):
+                headers["Content-Range"] = f"bytes */{len(content)}"
+                return web.Response(status=416, headers=headers)
+            status = 206
+            end = len(content) - 1
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(content)}"
+
+        response = web.StreamResponse(status=status, headers=headers)
+        response.content_length = len(content) - start
+        await response.prepare(request)
+        step = 64 * 1024
+        for i in range(start, len(content), step):
+            await response.write(content[i : i + step])
+            if self.bandwidth:
+                await asyncio.sleep(step / self.bandwidth)
+        await response.write_eof()
+        return response
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/posts.json", self.handle_posts)
+        app.router.add_get("/posts/{id}.json", self.handle_post)
+        app.router.add_get("/pools.json", self.handle_pools)
+        app.router.add_get("/pools/{id}.json", self.handle_pool)
+        app.router.add_get("/data/{a}/{b}/{md5}.{ext}", self.handle_file)
+        return app
+
+    async def start(self, port=0):
+        self.runner = web.AppRunner(self.app())
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=8621)
+    parser.add_argument("--posts", type=int, default=1000)
+    parser.add_argument("--file-size", type=int, default=256 * 1024)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--bandwidth", type=int, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    args = parser.parse_args()
+
+    server = FakeE621(
+        posts=args.posts,
+        file_size=args.file_size,
+        latency=args.latency,
+        bandwidth=args.bandwidth,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+    )
+
+    async def serve():
+        await server.start(args.port)
+        print(f"Serving on http://127.0.0.1:{server.port}")
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Runs the real yippi_dl CLI while sampling event-loop lag and peak RSS.
+
+The numbers are written as JSON to the file named by ``BENCH_REPORT``.
+"""
+import asyncio
+import atexit
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+
+class LagMonitor(threading.Thread):
+    daemon = True
+
+    def __init__(self, interval=0.05):
+        super().__init__()
+        self.interval = interval
+        self.loop = None
+        self.samples = []
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            loop = self.loop
+            if loop is None or loop.is_closed():
+                continue
+
+            done = threading.Event()
+            start = time.perf_counter()
+            try:
+                loop.call_soon_threadsafe(done.set)
+            except RuntimeError:
+                continue
+            if done.wait(5):
+                self.samples.append(time.perf_counter() - start)
+
+
+monitor = LagMonitor()
+
+
+class MonitoredPolicy(asyncio.DefaultEventLoopPolicy):
+    def new_event_loop(self):
+        monitor.loop = super().new_event_loop()
+        return monitor.loop
+
+
+def percentile(samples, q):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * q), len(samples) - 1)]
+
+
+def report():
+    path = os.environ.get("BENCH_REPORT")
+    if not path:
+        return
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        rss //= 1024
+    with open(path, "w") as f:
+        json.dump(
+            {
+                "peak_rss_kb": rss,
+                "lag_p50": percentile(monitor.samples, 0.5),
+                "lag_p99": percentile(monitor.samples, 0.99),
+                "lag_max": max(monitor.samples, default=0.0),
+            },
+            f,
+        )
+
+
+def main():
+    asyncio.set_event_loop_policy(MonitoredPolicy())
+    monitor.start()
+    atexit.register(report)
+
+    from yippi_dl.__main__ import main as cli
+
+    cli(prog_name="yippi_dl", obj={})
+
+
+if __name__ == "__main__":
+    main()
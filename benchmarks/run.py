@@ -0,0 +1,186 @@
+"""Offline throughput benchmark for yippi_dl.
+
+Starts the fake e621 server, drives ``batch``, ``post`` and ``pool``
+through the real CLI for every combination of ``--jobs`` and file size,
+and prints images/s, MB/s, peak RSS and event-loop lag for each run::
+
+    python -m benchmarks.run --jobs 1,4,16 --sizes 64K,1M --posts 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+from .fake_e621 import FakeE621
+
+UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+
+def parse_size(value):
+    value = value.strip().upper()
+    if value[-1] in UNITS:
+        return int(float(value[:-1]) * UNITS[value[-1]])
+    return int(value)
+
+
+def command_args(command, posts, pool_size):
+    if command == "batch":
+        return ["batch", "benchmark", "--cursor", "--limit", str(posts)]
+    if command == "post":
+        return ["post"] + [str(i) for i in range(1, posts + 1)]
+    if command == "pool":
+        pools = (posts + pool_size - 1) // pool_size
+        return ["pool"] + [str(i) for i in range(1, pools + 1)]
+    raise ValueError(f"Unknown command: {command}")
+
+
+def tree_size(path):
+    files = 0
+    size = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            files += 1
+            size += os.path.getsize(os.path.join(root, name))
+    return files, size
+
+
+async def run_once(server, command, jobs, args):
+    with tempfile.TemporaryDirectory() as output:
+        report = os.path.join(output, "report.json")
+        target = os.path.join(output, "files")
+        env = dict(os.environ, BENCH_REPORT=report)
+        # fmt: off
+        cli = [
+            sys.executable, "-m", "benchmarks.probe",
+            "--base-url", f"http://127.0.0.1:{server.port}",
+            "--api-rate", str(args.api_rate),
+            *args.extra,
+            *command_args(command, args.posts, server.pool_size),
+            "-o", target, "-j", str(jobs),
+        ]
+        # fmt: on
+
+        start = time.perf_counter()
+        process = await asyncio.create_subprocess_exec(
+            *cli,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+            env=env,
+        )
+        _, stderr = await process.communicate()
+        elapsed = time.perf_counter() - start
+
+        files, size = tree_size(target)
+        result = {
+            "command": command,
+            "jobs": jobs,
+            "file_size": server.file_size,
+            "files": files,
+            # Every command covers all the posts the server has.
+            "expected": args.posts,
+            "seconds": elapsed,
+            "images_per_s": files / elapsed,
+            "mb_per_s": size / elapsed / 1e6,
+            "returncode": process.returncode,
+        }
+        # A run that downloaded nothing is fast, but it is not a result.
+        result["ok"] = not process.returncode and files == args.posts
+        if os.path.exists(report):
+            with open(report) as f:
+                result.update(json.load(f))
+        if not result["ok"]:
+            result["stderr"] = stderr.decode(errors="replace")[-2000:]
+        return result
+
+
+async def run(args):
+    results = []
+    for size in args.sizes:
+        server = FakeE621(
+            posts=args.posts,
+            file_size=size,
+            latency=args.latency,
+            bandwidth=args.bandwidth,
+            error_rate=args.error_rate,
+        )
+        await server.start()
+        try:
+            for command in args.commands:
+                for jobs in args.jobs:
+                    result = await run_once(server, command, jobs, args)
+                    print_result(result)
+                    results.append(result)
+        finally:
+            await server.stop()
+    return results
+
+
+def print_result(result):
+    print(
+        "{command:<6} jobs={jobs:<3} size={file_size:<9} "
+        "files={files:<5} {images_per_s:8.1f} img/s {mb_per_s:8.2f} MB/s "
+        "rss={rss:7.1f} MiB lag p99={lag:6.1f} ms".format(
+            rss=result.get("peak_rss_kb", 0) / 1024,
+            lag=result.get("lag_p99", 0) * 1000,
+            **result,
+        ),
+        flush=True,
+    )
+    if not result["ok"]:
+        print(
+            "FAILED: {files}/{expected} files, exit code {returncode}".format(
+                **result
+            ),
+            file=sys.stderr,
+        )
+        print(result.get("stderr", ""), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument(
+        "--commands",
+        default="batch,post,pool",
+        type=lambda v: v.split(","),
+    )
+    parser.add_argument(
+        "--jobs", default="1,4,16", type=lambda v: list(map(int, v.split(",")))
+    )
+    parser.add_argument(
+        "--sizes",
+        default="64K,1M",
+        type=lambda v: list(map(parse_size, v.split(","))),
+    )
+    parser.add_argument("--posts", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument(
+        "--bandwidth",
+        type=parse_size,
+        default=0,
+        help="Per-transfer bytes/s, 0 for unlimited.",
+    )
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--api-rate", type=float, default=1000.0)
+    parser.add_argument("--json", help="Also write the results here.")
+    parser.add_argument(
+        "extra",
+        nargs="*",
+        help="Extra global yippi_dl options, after a `--`.",
+    )
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if not all(result["ok"] for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
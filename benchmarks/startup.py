@@ -0,0 +1,76 @@
+"""Cold start benchmark for yippi_dl.
+
+Times a few invocations that should never touch the network, and lists
+the slowest imports of the last one::
+
+    python -m benchmarks.startup --runs 20
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+CASES = {
+    "help": ["--help"],
+    "command help": ["batch", "--help"],
+    "usage error": ["post", "not-a-number"],
+    "empty job": ["post", "-o", "{output}"],
+}
+
+
+def time_case(args, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-m", "yippi_dl", *args],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def slowest_imports(args, count):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "yippi_dl", *args],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            imports.append((int(cumulative), name.rstrip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--imports", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as output:
+        for name, case in CASES.items():
+            case = [arg.format(output=output) for arg in case]
+            timings = time_case(case, args.runs)
+            print(
+                f"{name:<13} min {min(timings) * 1000:7.1f} ms  "
+                f"median {statistics.median(timings) * 1000:7.1f} ms"
+            )
+
+    print("\nSlowest imports for --help (cumulative):")
+    for cumulative, name in slowest_imports(["--help"], args.imports):
+        print(f"{cumulative / 1000:8.1f} ms {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,9 @@
+import multiprocessing
+
 from yippi_dl.__main__ import main
 
 if __name__ == '__main__':
+    # audit hashes files in worker processes, which a frozen build has to
+    # hand over to multiprocessing.
+    multiprocessing.freeze_support()
     main(obj={})
@@ -3,6 +3,8 @@
 block_cipher = None
 
 
+# Built as a one-folder app: a one-file build unpacks itself into a
+# temporary directory on every start, which dominates short runs.
 a = Analysis(['cli.py'],
              pathex=['D:\\bak\\yippi-dl'],
              binaries=[],
@@ -10,7 +12,7 @@ a = Analysis(['cli.py'],
              hiddenimports=['anyio._backends', 'anyio._backends._asyncio'],
              hookspath=[],
              runtime_hooks=[],
-             excludes=[],
+             excludes=['tkinter', 'unittest', 'pydoc', 'doctest'],
              win_no_prefer_redirects=False,
              win_private_assemblies=False,
              cipher=block_cipher,
@@ -19,15 +21,19 @@ pyz = PYZ(a.pure, a.zipped_data,
              cipher=block_cipher)
 exe = EXE(pyz,
           a.scripts,
-          a.binaries,
-          a.zipfiles,
-          a.datas,
           [],
+          exclude_binaries=True,
           name='cli',
           debug=False,
           bootloader_ignore_signals=False,
           strip=False,
-          upx=True,
-          upx_exclude=[],
-          runtime_tmpdir=None,
+          upx=False,
           console=True )
+coll = COLLECT(exe,
+               a.binaries,
+               a.zipfiles,
+               a.datas,
+               strip=False,
+               upx=False,
+               upx_exclude=[],
+               name='cli')
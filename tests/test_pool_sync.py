@@ -0,0 +1,51 @@
+import asyncio
+import os
+import sys
+
+from aiohttp import web
+
+from benchmarks.fake_e621 import FakeE621
+
+
+class FlakyLookup(FakeE621):
+    """Fails the first id: search, the way a dropped API call would."""
+
+    failures = 1
+
+    async def handle_posts(self, request):
+        if self.failures and "id:" in request.query.get("tags", ""):
+            self.failures -= 1
+            return web.Response(status=500)
+        return await super().handle_posts(request)
+
+
+async def run_cli(server, *args):
+    # fmt: off
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "-m", "yippi_dl",
+        "--base-url", f"http://127.0.0.1:{server.port}",
+        "--api-rate", "1000", "--no-print-posts", *args,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.DEVNULL,
+    )
+    # fmt: on
+    return await process.wait()
+
+
+def downloaded(path):
+    return [name for name in os.listdir(path) if name.endswith(".png")]
+
+
+def test_failed_lookup_stays_pending(tmp_path):
+    async def scenario():
+        server = FlakyLookup(posts=25, file_size=1024, static_host="127.0.0.1")
+        await server.start()
+        try:
+            await run_cli(server, "pool", "--sync", "-o", str(tmp_path), "1")
+            assert downloaded(tmp_path) == []
+            await run_cli(server, "pool", "--sync", "-o", str(tmp_path), "1")
+        finally:
+            await server.stop()
+
+    asyncio.run(scenario())
+    assert len(downloaded(tmp_path)) == 25
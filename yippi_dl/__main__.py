@@ -1,33 +1,57 @@
 import asyncio
+import json
 import os
 import sys
-import traceback
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
-import aiohttp
 import asyncclick as click
 
-from yippi import AsyncYippiClient
-
 from .helper import (
+    LAYOUT_DEPTH,
+    STATE_FILE,
+    Download,
     ask_skip,
+    batch_ids,
     common_decorator,
-    download_worker,
     echo,
     error,
-    get_pool,
-    get_post,
+    get_pool_id,
+    get_pool_posts,
+    get_pools,
+    get_post_id,
+    get_posts,
+    iterate_posts,
+    layout_dir,
     print_pool,
+    read_ids,
+    report_failed,
+    save_metadata,
+    scan_tree,
+    search_posts,
+    setup_logging,
+    spawn_workers,
+    stream_posts,
     verbose,
     warning,
 )
+from .progress import Progress
+from .ratelimit import AdaptiveLimit, TokenBucket
+from .schedule import ORDER_WINDOW, ORDERS, SizeQueue
+from .session import make_cdn_session, make_client, make_session
+from .shard import in_shard, parse_shard, run_shard, shard_total
+from .stats import Stats
 
 click.anyio_backend = "asyncio"
 
 
 class CustomObj:
     obj = {}
+    factories = {}
 
     def __getitem__(self, x):
+        if x not in self.obj and x in self.factories:
+            self.obj[x] = self.factories.pop(x)()
         return self.obj[x]
 
     def __setitem__(self, key, val):
@@ -36,10 +60,29 @@ class CustomObj:
     def __call__(self):
         return self
 
+    def get(self, key, default=None):
+        # Never builds a lazy value, so it's safe to use during cleanup.
+        return self.obj.get(key, default)
+
+    def lazy(self, key, factory):
+        self.factories[key] = factory
+
 
 obj = CustomObj()
 
 
+async def cleanup(steps):
+    # One failing step mustn't keep the rest, e.g. committing the
+    # manifest, from running.
+    for step in steps:
+        try:
+            result = step()
+            if asyncio.iscoroutine(result):
+                await result
+        except Exception as err:
+            error(f"Cleaning up failed: `{err.__class__.__name__}`")
+
+
 class CustomGroup(click.Group):
     async def _main(self, main, args, kwargs):
         save_exception = None
@@ -48,12 +91,31 @@ class CustomGroup(click.Group):
         except Exception as e:
             save_exception = e
 
+        steps = []
+        cdn_session = obj.get("cdn_session")
+        if cdn_session and cdn_session is not obj.get("session"):
+            steps.append(cdn_session.close)
         if "client" in obj.obj:
-            await obj["client"].close()
+            steps.append(obj["client"].close)
+        elif "session" in obj.obj:
+            steps.append(obj["session"].close)
+        if obj.get("stats_path"):
+            steps.append(lambda: obj["stats"].write(obj["stats_path"]))
+        if obj.get("metadata"):
+            steps.append(obj["metadata"].close)
+        if obj.get("manifest"):
+            steps.append(obj["manifest"].close)
+        if obj.get("executor"):
+            steps.append(obj["executor"].shutdown)
+        if obj.get("log_listener"):
+            steps.append(obj["log_listener"].stop)
+        await cleanup(steps)
 
         if save_exception:
             ignored = (click.Abort, click.ClickException)
             if isinstance(save_exception, ignored):
+                if isinstance(save_exception, click.ClickException):
+                    save_exception.show()
                 sys.exit(1)
         return return_code
 
@@ -64,16 +126,224 @@ class CustomGroup(click.Group):
     cls=CustomGroup,
 )
 @click.option("-v", "--verbose", "v", is_flag=True)
+@click.option(
+    "-m",
+    "--manifest",
+    type=click.Path(dir_okay=False),
+    help="SQLite index of downloaded files, shared across runs.",
+)
+@click.option(
+    "--dedupe",
+    type=click.Choice(["skip", "link", "copy"]),
+    default="link",
+    # fmt: off
+    help="What to do when the manifest already has the file "
+         "somewhere else.",
+    # fmt: on
+)
+@click.option(
+    "--api-rate",
+    default=2.0,
+    type=float,
+    help="Maximum API requests per second.",
+)
+@click.option(
+    "--retries",
+    default=3,
+    type=int,
+    help="How many times a failed download is retried.",
+)
+@click.option(
+    "--connections",
+    default=100,
+    type=int,
+    help="Most connections open at once for file downloads.",
+)
+@click.option(
+    "--connections-per-host",
+    default=0,
+    type=int,
+    help="Most connections open at once to one host, 0 for no limit.",
+)
+@click.option(
+    "--keepalive",
+    default=30.0,
+    type=float,
+    help="Seconds an idle connection is kept open for reuse.",
+)
+@click.option(
+    "--dns-ttl",
+    default=300,
+    type=int,
+    help="Seconds a DNS answer is cached.",
+)
+@click.option(
+    "--separate-cdn/--shared-session",
+    default=True,
+    # fmt: off
+    help="Give API requests their own connections, so big downloads "
+         "can't hold them up.",
+    # fmt: on
+)
+@click.option(
+    "--chunk-size",
+    default=1024 * 1024,
+    type=click.IntRange(min=1),
+    help="Bytes buffered before each disk write.",
+)
+@click.option(
+    "--io-threads",
+    default=4,
+    type=click.IntRange(min=1),
+    help="Number of threads doing disk writes.",
+)
+@click.option(
+    "--preallocate",
+    is_flag=True,
+    # fmt: off
+    help="Reserve disk space for each file before writing it. "
+         "A hard crash leaves a .part file that has to be redownloaded.",
+    # fmt: on
+)
+@click.option(
+    "--layout",
+    type=click.Choice(list(LAYOUT_DEPTH)),
+    default="flat",
+    # fmt: off
+    help="Where files go in the output directory: all in one place, "
+         "in md5 prefix folders (ab/cd/) or in folders of 1000 post ids.",
+    # fmt: on
+)
+@click.option(
+    "--order",
+    type=click.Choice(ORDERS),
+    default="api",
+    # fmt: off
+    help="Download order. largest finishes big batches sooner, smallest "
+         "gets the first files in sooner.",
+    # fmt: on
+)
+@click.option(
+    "--large-size",
+    default=32 * 1024 * 1024,
+    type=int,
+    help="Files at least this many bytes count as large.",
+)
+@click.option(
+    "--large-jobs",
+    default=0,
+    type=int,
+    help="Most large files downloaded at once, 0 for no limit.",
+)
+@click.option(
+    "--stats",
+    type=click.Path(dir_okay=False),
+    # fmt: off
+    help="Write transfer and API metrics here when done. "
+         "Prometheus textfile format if it ends with .prom, JSON otherwise.",
+    # fmt: on
+)
+@click.option(
+    "--metadata",
+    type=click.Path(dir_okay=False),
+    # fmt: off
+    help="Save a record of every downloaded post here. SQLite if it ends "
+         "with .sqlite or .db, JSON lines otherwise.",
+    # fmt: on
+)
+@click.option(
+    "--print-posts/--no-print-posts",
+    default=None,
+    help="Print each post while downloading. Off when --metadata is used.",
+)
+@click.option(
+    "--log-file",
+    type=click.Path(dir_okay=False),
+    help="Write diagnostics to this file, written off the event loop.",
+)
+@click.option(
+    "--shard",
+    metavar="INDEX/COUNT",
+    callback=parse_shard,
+    # fmt: off
+    help="Only download posts whose id modulo COUNT is INDEX, to split "
+         "one job across processes or machines.",
+    # fmt: on
+)
+@click.option("--base-url", envvar="YIPPI_DL_BASE_URL", hidden=True)
 @click.pass_context
-async def main(ctx, v):
+async def main(
+    ctx,
+    v,
+    manifest,
+    dedupe,
+    api_rate,
+    retries,
+    connections,
+    connections_per_host,
+    keepalive,
+    dns_ttl,
+    separate_cdn,
+    chunk_size,
+    io_threads,
+    preallocate,
+    layout,
+    order,
+    large_size,
+    large_jobs,
+    stats,
+    metadata,
+    print_posts,
+    log_file,
+    shard,
+    base_url,
+):
     """An e621 batch downloader."""
     ctx.obj = obj
     ctx.obj["verbose"] = v
+    ctx.obj["log_listener"] = setup_logging(v, log_file)
+    ctx.obj["shard"] = shard
+    ctx.obj["manifest"] = None
+    if manifest:
+        from .manifest import COMMIT_EVERY, Manifest
+
+        # Other shards share the file, so don't hold the write lock long.
+        commit_every = 1 if shard else COMMIT_EVERY
+        ctx.obj["manifest"] = Manifest(manifest, commit_every)
+    ctx.obj["dedupe"] = dedupe
+    ctx.obj["metadata"] = None
+    if metadata:
+        from .metadata import open_sink
+
+        ctx.obj["metadata"] = open_sink(metadata)
+    if print_posts is None:
+        print_posts = not metadata
+    ctx.obj["print_posts"] = print_posts
     verbose("Initialize objects")
-    ctx.obj["session"] = aiohttp.ClientSession()
-    ctx.obj["client"] = AsyncYippiClient(
-        "yippi_dl", "0.1.0", "Error-", ctx.obj["session"]
-    )
+    ctx.obj["retries"] = retries
+    ctx.obj["stats"] = Stats()
+    ctx.obj["stats_path"] = stats
+    ctx.obj["chunk_size"] = chunk_size
+    ctx.obj["preallocate"] = preallocate
+    ctx.obj["layout"] = layout
+    ctx.obj["order"] = order
+    ctx.obj["large_size"] = large_size
+    ctx.obj["large_jobs"] = large_jobs
+    ctx.obj["executor"] = ThreadPoolExecutor(max_workers=io_threads)
+    ctx.obj["api_bucket"] = TokenBucket(api_rate)
+    ctx.obj["limiter"] = None
+    ctx.obj["connector"] = {
+        "limit": connections,
+        "per_host": connections_per_host,
+        "keepalive": keepalive,
+        "dns_ttl": dns_ttl,
+        "separate_cdn": separate_cdn,
+    }
+    # Built on first use, so --help, usage errors and commands that never
+    # touch the network don't pay for aiohttp and yippi.
+    ctx.obj.lazy("session", lambda: make_session(ctx.obj, base_url))
+    ctx.obj.lazy("client", lambda: make_client(ctx.obj["session"]))
+    ctx.obj.lazy("cdn_session", lambda: make_cdn_session(ctx.obj))
     ctx.obj["interactive"] = False
     ctx.obj["banner_printed"] = False
 
@@ -87,194 +357,606 @@ async def main(ctx, v):
 
 @main.command()
 @click.argument("pool_id", type=int, nargs=-1)
+@click.option(
+    "--sync",
+    is_flag=True,
+    # fmt: off
+    help="Only download posts added since the last sync, keeping "
+         "their numbers stable.",
+    # fmt: on
+)
+@click.option(
+    "-s",
+    "--state",
+    "state_path",
+    type=click.Path(dir_okay=False),
+    help=f"Sync state file. Defaults to {STATE_FILE} in the output directory.",
+)
+@click.option(
+    "-i",
+    "--input",
+    "input_path",
+    type=click.Path(exists=True, dir_okay=False, allow_dash=True),
+    # fmt: off
+    help="Also read pool ids or URLs from this file, one per line. "
+         "- reads stdin.",
+    # fmt: on
+)
+@click.option(
+    "--archive",
+    is_flag=True,
+    # fmt: off
+    help="Save every pool as one CBZ file instead of a file per page. "
+         "Picks up where an existing archive left off.",
+    # fmt: on
+)
 @common_decorator
-async def pool(ctx, pool_id, output, jobs, type, pools=None):
+async def pool(
+    ctx,
+    pool_id,
+    input_path,
+    sync,
+    state_path,
+    archive,
+    output,
+    jobs,
+    type,
+    pools=None,
+):
     """Download pool(s)."""
+    if input_path:
+        # Pools are looked up and downloaded a batch at a time as the
+        # input comes in.
+        pool_ids = read_ids(input_path, get_pool_id, pool_id)
+        async for chunk in batch_ids(pool_ids):
+            # fmt: off
+            await ctx.invoke(
+                ctx.command, pool_id=chunk, sync=sync, state_path=state_path,
+                archive=archive, output=output, jobs=jobs, type=type,
+            )
+            # fmt: on
+        return
+
     if isinstance(pool_id, int) and pool_id < 0 and not pools:
         error("No pools found. Breaking.")
         return
+    if archive and ctx.obj["shard"]:
+        raise click.UsageError("--archive can't be split into shards.")
     os.makedirs(output, exist_ok=True)
 
     if not pools:
-        pools = []
-        for pid in pool_id:
-            echo("Fetching pool...")
-
-            pool = await get_pool(ctx, pid)
-            if not pool:
-                warning(f"Pool #{pid} was not found. Skipping.")
-                continue
-            pools.append(pool)
-
-    for pool in pools:
+        echo("Fetching pools...")
+        pools = await get_pools(ctx, pool_id)
+        if not pools:
+            error("No pools found. Breaking.")
+            return
+
+    state = None
+    plans = None
+    if sync:
+        from .state import State
+
+        state = State(state_path or os.path.join(output, STATE_FILE))
+        plans = {}
+        for pool in pools:
+            plan = state.plan_pool(pool)
+            if plan:
+                plans[pool.id] = plan
+            else:
+                echo(f"Pool #{pool.id} is up to date.")
+        pools = [pool for pool in pools if pool.id in plans]
+        if not pools:
+            state.close()
+            echo("Every pool is up to date.")
+            return
+
+    try:
         if not ctx.obj["interactive"]:
             ctx.obj["banner_printed"] = True
-            echo("==================")
-            print_pool(pool)
+            for pool in pools:
+                echo("==================")
+                print_pool(pool)
+
+        # Every pool feeds the same worker set, pages keep their numbers.
+        # Archives are written one pool at a time.
+        groups = [[pool] for pool in pools] if archive else [pools]
+        for group in groups:
+            await download_pools(
+                ctx, group, plans, state, archive, output, jobs, type
+            )
+    finally:
+        if state:
+            state.close()
 
-        echo("Gathering posts...")
-        posts = await pool.get_posts()
+
+async def download_pools(
+    ctx, pools, plans, state, archive, output, jobs, type
+):
+    if plans is None:
+        post_ids = [p for pool in pools for p in pool.post_ids]
+    else:
+        post_ids = [p for pool in pools for p in plans[pool.id]]
+    total = sum(1 for p in post_ids if in_shard(ctx, p))
+
+    target = None
+    if archive:
+        from .archive import Archive, archive_name
+
+        path = os.path.join(output, archive_name(pools[0]))
+        echo(f"Writing to {path}")
+        target = Archive(path, ctx.obj["executor"])
+
+    # Only posts the lookup returned can be marked done, the rest stay
+    # pending for the next sync.
+    found = set()
+
+    async def track(posts):
+        async for number, post in posts:
+            found.add(post.id)
+            yield number, post
+
+    echo("Gathering posts...")
+    try:
         await ctx.invoke(
             post,
             post_id=-1,
             output=output,
             jobs=jobs,
             type=type,
-            posts=posts,
+            posts=track(get_pool_posts(ctx, pools, plans)),
             add_number=True,
+            total=total,
+            archive=target,
         )
+    finally:
+        if target:
+            await target.close()
+
+    if state:
+        failed = {item.post.id for item, _ in ctx.obj.get("failed", [])}
+        for pool in pools:
+            done = [
+                p for p in plans[pool.id] if p in found and p not in failed
+            ]
+            state.finish_pool(pool, done)
 
 
 @main.command()
 @click.argument("post_id", type=int, nargs=-1)
+@click.option(
+    "-i",
+    "--input",
+    "input_path",
+    type=click.Path(exists=True, dir_okay=False, allow_dash=True),
+    # fmt: off
+    help="Also read post ids or URLs from this file, one per line. "
+         "- reads stdin.",
+    # fmt: on
+)
 @common_decorator
-async def post(ctx, post_id, output, jobs, type, posts=None, add_number=False):
+async def post(
+    ctx,
+    post_id,
+    input_path,
+    output,
+    jobs,
+    type,
+    posts=None,
+    add_number=False,
+    total=None,
+    archive=None,
+):
     """Download post(s)."""
     if isinstance(post_id, int) and post_id < 0 and not posts:
         error("No posts found. Breaking.")
         return
     os.makedirs(output, exist_ok=True)
 
-    if not posts:
+    shard = ctx.obj["shard"]
+    if input_path:
+        echo("Reading posts...")
+        post_ids = read_ids(input_path, get_post_id, post_id)
+        posts = stream_posts(ctx, post_ids)
+        total = 0
+    elif not posts:
         verbose("posts is not provided and post_id is valid. Asking API.")
-        posts = []
         echo("Gathering posts...")
-        for post in post_id:
-            obj = await get_post(ctx, post)
-            if obj:
-                posts.append(obj)
-
-    verbose("Checking posts if image is deleted.")
-    valid_posts = []
-    for post in posts:
-        if getattr(post, type)["url"]:
-            valid_posts.append(post)
-        else:
-            warning(f"Warning: Post #{post.id} has been deleted.")
-    posts = valid_posts
-
-    total = len(posts)
-    workers = []
-    queue = asyncio.Queue()
-    always_skip = False
+        post_id = [i for i in post_id if in_shard(ctx, i)]
+        posts = await get_posts(ctx, post_id)
+
+    if total is None:
+        total = len(posts)
+
+    # One pass over the output tree instead of a stat per post.
+    layout = ctx.obj["layout"]
+    on_disk = await asyncio.get_event_loop().run_in_executor(
+        None, scan_tree, output, LAYOUT_DEPTH[layout]
+    )
+    made = {output}
+
+    manifest = ctx.obj["manifest"]
+    downloaded = 0
+    if ctx.obj["order"] == "api":
+        maxsize = jobs * 2
+    else:
+        # Ordering needs a pool of waiting files to choose from.
+        maxsize = max(jobs * 2, ORDER_WINDOW)
+    queue = SizeQueue(
+        maxsize,
+        ctx.obj["order"],
+        ctx.obj["large_size"],
+        ctx.obj["large_jobs"],
+    )
+    # Nobody can answer a prompt for several shards at once.
+    always_skip = bool(shard)
     always_replace = False
-    verbose("Total posts: " + str(total))
-    with click.progressbar(length=total, label="Downloading posts...") as bar:
-        verbose(f"Spawning {jobs} workers.")
-        for _ in range(jobs):
-            # fmt: off
-            task = asyncio.create_task(
-                download_worker(ctx, ctx.obj["session"], bar, queue)
-            )
-            # fmt: on
-            workers.append(task)
+    verbose("Total posts: %s", total)
+    # -j is the ceiling, the limiter settles on what the server tolerates.
+    ctx.obj["limiter"] = AdaptiveLimit(jobs)
+    ctx.obj["failed"] = []
+    ctx.obj["retrying"] = set()
+    with Progress(total) as bar:
+        workers = spawn_workers(ctx, jobs, bar, queue)
+
+        number = None
+        verbose("Sending posts to queue.")
+        async for post in iterate_posts(posts):
+            if add_number:
+                number, post = post
+            if not in_shard(ctx, post.id):
+                continue
 
-        number = 1
-        verbose(f"Sending posts to queue.")
-        for post in posts:
             image_url = getattr(post, type)["url"]
+            if not image_url:
+                warning(f"Warning: Post #{post.id} has been deleted.")
+                bar.update(1)
+                continue
+
             image_name = image_url.split("/")[-1]
-            if add_number:
+            if archive:
+                # Padded so readers that sort by name keep pool order.
+                name = f"{number:04d} - {image_name}"
+                if name in archive:
+                    bar.update(1)
+                    continue
+                downloaded += 1
+                target = os.path.join(archive.path, name)
+                data = Download(image_url, target, post, type, archive, number)
+                archive.expect(number)
+                bar.add(data)
+                await queue.put(data)
+                continue
+
+            if number:
                 image_name = f"{number} - " + image_name
 
-            image_path = os.path.join(output, image_name)
+            relative = os.path.join(layout_dir(layout, post), image_name)
+            image_path = os.path.join(output, relative)
+            directory = os.path.dirname(image_path)
+            if directory not in made:
+                os.makedirs(directory, exist_ok=True)
+                made.add(directory)
+
             if not always_replace:
-                if os.path.exists(image_path):
+                if relative in on_disk:
                     if always_skip:
-                        total -= 1
                         bar.update(1)
                         continue
                     choice = ask_skip(image_path)
 
                     if choice in ("y", "a"):
-                        total -= 1
                         always_skip = choice == "a"
+                        if manifest:
+                            manifest.add(post, type, image_path)
                         bar.update(1)
                         continue
                     always_replace = choice == "e"
-
-            number += 1
-            data = [image_url, image_path, post]
-            verbose("Sending: " + str(data))
+                # Answering no asks for a fresh download, not a copy.
+                existing = None
+                if relative not in on_disk:
+                    existing = manifest and manifest.find(post, type)
+                if existing and os.path.exists(image_path):
+                    if os.path.samefile(existing, image_path):
+                        # Saved earlier in this run, e.g. a post that came
+                        # up on two pages.
+                        bar.update(1)
+                        continue
+                if existing:
+                    verbose("Post #%s is already at %s", post.id, existing)
+                    if ctx.obj["dedupe"] != "skip":
+                        from .manifest import reuse_file
+
+                        await asyncio.get_event_loop().run_in_executor(
+                            None,
+                            reuse_file,
+                            existing,
+                            image_path,
+                            ctx.obj["dedupe"],
+                        )
+                        manifest.add(post, type, image_path)
+                        save_metadata(ctx, post, type, image_path)
+                    bar.update(1)
+                    continue
+
+            downloaded += 1
+            data = Download(image_url, image_path, post, type)
+            verbose("Sending: %s", data)
+            bar.add(data)
             await queue.put(data)
 
         await queue.join()
 
     verbose("Cancelling workers.")
+    workers = list(workers)
     for task in workers:
         task.cancel()
     await asyncio.gather(*workers, return_exceptions=True)
-    echo(f"Done downloading {total} image(s)!")
+    downloaded -= len(ctx.obj["failed"])
+    echo(f"Done downloading {downloaded} image(s)!")
+    report_failed(ctx)
 
 
 @main.command()
 @click.argument("query", nargs=-1)
 @click.option(
-    "-l", "--limit", type=int, default=100, help="Number of posts to download."
+    "-l",
+    "--limit",
+    type=int,
+    default=100,
+    # fmt: off
+    help="Number of posts to download. "
+         "0 downloads everything in cursor mode.",
+    # fmt: on
+)
+@click.option(
+    "-c",
+    "--cursor",
+    is_flag=True,
+    # fmt: off
+    help="Paginate by post id instead of page number. "
+         "Removes the 1000 posts limit.",
+    # fmt: on
+)
+@click.option(
+    "--prefetch",
+    default=2,
+    type=int,
+    help="Number of result pages fetched ahead of the downloads.",
 )
 @common_decorator
-async def batch(ctx, query, limit, output, jobs, type):
+async def batch(ctx, query, limit, cursor, prefetch, output, jobs, type):
     """Batch download post with given search query."""
     os.makedirs(output, exist_ok=True)
-    pagination_mode = False
-    query_limit = limit
-
-    verbose("Checking if pagination should be enabled.")
-    if limit > 320:
-        verbose("Limit is more than 320, enabling pagination.")
-        pagination_mode = True
-        query_limit = 320
 
-    if limit > 1000:
+    if not cursor and not 0 < limit <= 1000:
         # fmt: off
         warning("Warning: You're downloading too much."
-                "Limiting to 1000 posts.")
+                "Limiting to 1000 posts, use --cursor to go further.")
         # fmt: on
         limit = 1000
 
-    posts = []
-    if pagination_mode:
-        verbose("Pagination mode start.")
-        page = 1
-        while len(posts) < limit:
-            if limit - len(posts) < 320:
-                query_limit = limit - len(posts)
-            verbose(f"Asking page: {page} | limit: {query_limit}")
-
-            try:
-                api_response = await ctx.obj["client"].posts(
-                    list(query), query_limit, page
-                )
-            except Exception as err:
-                # fmt: off
-                if ctx.obj["verbose"]:
-                    traceback.print_exception(
-                        type(err), err, err.__traceback__
-                    )
-
-                error(
-                    f"An exception has occured: `{err.__class__.__name__}`"
-                )
-                # fmt: on
-                break
+    # Pages are streamed straight into the download queue, so downloads
+    # start as soon as the first page arrives.
+    posts = search_posts(ctx, query, limit, cursor, prefetch)
+    # fmt: off
+    await ctx.invoke(
+        post, post_id=-1, output=output, jobs=jobs, type=type, posts=posts,
+        total=shard_total(ctx, limit),
+    )
+    # fmt: on
+
+
+@main.command()
+@click.argument("query", nargs=-1)
+@click.option(
+    "-l",
+    "--limit",
+    type=int,
+    default=100,
+    # fmt: off
+    help="Number of posts to download on the first sync. "
+         "0 downloads everything.",
+    # fmt: on
+)
+@click.option(
+    "-s",
+    "--state",
+    "state_path",
+    type=click.Path(dir_okay=False),
+    help=f"Sync state file. Defaults to {STATE_FILE} in the output directory.",
+)
+@click.option(
+    "-i",
+    "--interval",
+    type=float,
+    default=0,
+    help="Keep running and check for new posts every N seconds.",
+)
+@click.option(
+    "--prefetch",
+    default=2,
+    type=int,
+    help="Number of result pages fetched ahead of the downloads.",
+)
+@common_decorator
+async def sync(
+    ctx, query, limit, state_path, interval, prefetch, output, jobs, type
+):
+    """Download posts added since the last sync of a search query."""
+    from .state import State
+
+    os.makedirs(output, exist_ok=True)
+    state = State(state_path or os.path.join(output, STATE_FILE))
+    # Each shard gets through the results at its own pace.
+    key = list(query)
+    if ctx.obj["shard"]:
+        key.append("shard:{}/{}".format(*ctx.obj["shard"]))
+    try:
+        while True:
+            last_id = state.last_id(key)
+            newest = await sync_query(
+                ctx, query, limit, last_id, prefetch, output, jobs, type
+            )
+            if newest > last_id:
+                verbose("Highest post id for %s is now %d", query, newest)
+                state.set_last_id(key, newest)
 
-            if not api_response:
-                warning(
-                    "Warning: API doesn't reply anything, stopping and starts "
-                    "download routine."
-                )
+            if not interval:
                 break
-            posts.extend(api_response)
-            page += 1
+            echo(f"Next check in {interval:g} seconds.")
+            await asyncio.sleep(interval)
+    finally:
+        state.close()
+
+
+async def sync_query(ctx, query, limit, last_id, prefetch, output, jobs, type):
+    seen = []
+
+    async def track(posts):
+        async for post in posts:
+            seen.append(post.id)
+            yield post
+
+    search = list(query)
+    if last_id:
+        echo(f"Looking for posts newer than #{last_id}...")
+        search.append(f"id:>{last_id}")
+        limit = 0
     else:
-        verbose("Running without pagination mode. Asking API.")
-        posts.extend(await ctx.obj["client"].posts(list(query), query_limit))
+        echo("First sync, looking for the latest posts...")
+
+    status = {}
+    posts = track(search_posts(ctx, search, limit, True, prefetch, status))
     # fmt: off
     await ctx.invoke(
-        post, post_id=-1, output=output, jobs=jobs, type=type, posts=posts
+        post, post_id=-1, output=output, jobs=jobs, type=type, posts=posts,
+        total=shard_total(ctx, limit),
     )
     # fmt: on
 
+    if not status["complete"]:
+        # Pages are walked from the newest post down, the ones that were
+        # never fetched sit between last_id and what was seen.
+        warning("Warning: Not every page was fetched, keeping the last sync.")
+        return last_id
+
+    newest = max(seen, default=last_id)
+    failed = [item.post.id for item, _ in ctx.obj.get("failed", [])]
+    if failed:
+        # Stay below the oldest failure so the next sync picks it up again.
+        newest = min(newest, min(failed) - 1)
+    return max(newest, last_id)
+
+
+@main.command()
+@click.argument(
+    "path", default=".", type=click.Path(exists=True, file_okay=False)
+)
+@click.option(
+    "-j",
+    "--jobs",
+    type=int,
+    default=os.cpu_count() or 1,
+    help="Number of processes hashing files, defaults to one per CPU.",
+)
+@click.option(
+    "--delete",
+    is_flag=True,
+    help="Remove files that don't match, so the next run gets them again.",
+)
+@click.pass_context
+async def audit(ctx, path, jobs, delete):
+    """Check downloaded originals against the md5 in their name.
+
+    Samples and previews are named after the original's md5 too, only the
+    --manifest can tell them apart.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    from .audit import check_file, find_files
+
+    manifest = ctx.obj["manifest"]
+    if delete and not manifest:
+        error("--delete needs --manifest to tell originals from samples.")
+        return
+
+    echo(f"Checking files in {path}...")
+    loop = asyncio.get_event_loop()
+    files = await loop.run_in_executor(None, list, find_files(path))
+    if manifest:
+        types = manifest.types()
+        # fmt: off
+        files = [
+            (file, md5) for file, md5 in files
+            if types.get(os.path.abspath(file)) == "file"
+        ]
+        # fmt: on
+    else:
+        # fmt: off
+        warning("Warning: Without --manifest every file is taken for an "
+                "original, samples and previews will be reported as bad.")
+        # fmt: on
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        results = await loop.run_in_executor(
+            None, lambda: list(pool.map(check_file, files, chunksize=64))
+        )
+
+    bad = [result for result in results if result]
+    for result in bad:
+        error(f"{result} doesn't match its md5.")
+        if delete:
+            os.remove(result)
+    echo(f"Checked {len(files)} file(s), {len(bad)} bad.")
+
+
+@main.command(
+    context_settings=dict(
+        ignore_unknown_options=True, allow_interspersed_args=False
+    )
+)
+@click.option(
+    "-n",
+    "--shards",
+    type=int,
+    default=os.cpu_count() or 1,
+    help="Number of processes, defaults to one per CPU.",
+)
+@click.argument("args", nargs=-1, type=click.UNPROCESSED, required=True)
+@click.pass_context
+async def parallel(ctx, shards, args):
+    """Split a batch, post, pool or sync run across local processes.
+
+    Every process downloads its own --shard of the posts, the API rate is
+    shared between them and their stats are merged at the end.
+    """
+    if args[0] not in ("batch", "post", "pool", "sync"):
+        raise click.UsageError(f"Can't run `{args[0]}` in parallel.")
+    if ctx.obj["shard"]:
+        raise click.UsageError("--shard can't be combined with parallel.")
+    for option, value in zip(args, args[1:]):
+        if option in ("-i", "--input") and value == "-":
+            raise click.UsageError("Processes can't share stdin, use a file.")
+
+    echo(f"Starting {shards} processes...")
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = [os.path.join(tmp, f"{i}.json") for i in range(shards)]
+        codes = await asyncio.gather(
+            *(run_shard(ctx, i, shards, args, paths[i]) for i in range(shards))
+        )
+        for path in paths:
+            if os.path.exists(path):
+                with open(path) as f:
+                    ctx.obj["stats"].merge(json.load(f))
+
+    files = ctx.obj["stats"].summary()["files"]
+    echo(f"Done downloading {files['ok']} image(s) in {shards} processes!")
+    if files["failed"]:
+        error(f"{files['failed']} file(s) could not be downloaded.")
+    failed = [str(i) for i, code in enumerate(codes) if code]
+    if failed:
+        error(f"Shard(s) {', '.join(failed)} exited with an error.")
+        raise click.Abort()
+
 
 if __name__ == "__main__":
     main(obj={})
@@ -0,0 +1,113 @@
+import asyncio
+import os
+import re
+import struct
+import zipfile
+import zlib
+from collections import deque
+
+from .helper import warning
+
+# Pages held in memory waiting for an earlier one.
+BUFFER = 32
+LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+unsafe_re = re.compile(r'[\\/:*?"<>|]')
+
+
+def archive_name(pool):
+    return unsafe_re.sub("_", f"{pool.id} - {pool.name}") + ".cbz"
+
+
+def salvage(broken, path):
+    """Copy the complete entries of an archive that never got its central
+    directory, walking the headers in front of each entry instead."""
+    count = 0
+    with open(broken, "rb") as f, zipfile.ZipFile(path, "w") as out:
+        while True:
+            header = f.read(LOCAL_HEADER.size)
+            if len(header) < LOCAL_HEADER.size:
+                break
+            # fmt: off
+            (signature, _, flags, method, _, _, crc, size, _,
+             name_size, extra_size) = LOCAL_HEADER.unpack(header)
+            # fmt: on
+            if signature != b"PK\x03\x04" or method != zipfile.ZIP_STORED:
+                break
+            name = f.read(name_size)
+            name = name.decode("utf-8" if flags & 0x800 else "cp437")
+            f.seek(extra_size, os.SEEK_CUR)
+            data = f.read(size)
+            if len(data) < size or zlib.crc32(data) != crc:
+                break
+            out.writestr(name, data, zipfile.ZIP_STORED)
+            count += 1
+    return count
+
+
+class Archive:
+    """Collects the pages of a pool into one zip file.
+
+    Pages are written in the order they were queued. Pages that finish
+    early wait in memory, and once more than BUFFER of them wait the
+    lowest one is written out of order. An existing archive is appended
+    to, skipping the pages its central directory lists.
+    """
+
+    def __init__(self, path, executor):
+        self.path = path
+        self.executor = executor
+        # Append mode would quietly start a second archive after a damaged
+        # one, e.g. when a crash kept the central directory from being
+        # written.
+        if os.path.exists(path) and not zipfile.is_zipfile(path):
+            broken = path + ".broken"
+            os.replace(path, broken)
+            count = salvage(broken, path)
+            warning(f"Warning: {path} was damaged, recovered {count} pages.")
+            os.remove(broken)
+        self.zip = zipfile.ZipFile(path, "a")
+        self.names = set(self.zip.namelist())
+        self.order = deque()
+        self.pending = {}
+        self.skipped = set()
+        self.lock = asyncio.Lock()
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def expect(self, number):
+        self.order.append(number)
+
+    def drop(self, number):
+        self.skipped.add(number)
+
+    async def add(self, number, name, data):
+        self.pending[number] = (name, data)
+        async with self.lock:
+            await self.flush()
+
+    async def flush(self, everything=False):
+        loop = asyncio.get_event_loop()
+        while self.pending:
+            while self.order and self.order[0] in self.skipped:
+                self.order.popleft()
+            if self.order and self.order[0] in self.pending:
+                number = self.order.popleft()
+            elif everything or len(self.pending) > BUFFER:
+                number = min(self.pending)
+                self.skipped.add(number)
+            else:
+                break
+            name, data = self.pending.pop(number)
+            await loop.run_in_executor(self.executor, self.write, name, data)
+            self.names.add(name)
+
+    def write(self, name, data):
+        # Pages are already compressed images, store them as they are.
+        self.zip.writestr(name, data, zipfile.ZIP_STORED)
+
+    async def close(self):
+        async with self.lock:
+            await self.flush(everything=True)
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(self.executor, self.zip.close)
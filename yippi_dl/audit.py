@@ -0,0 +1,35 @@
+import hashlib
+import os
+import re
+
+BLOCK_SIZE = 1024 * 1024
+# Downloads are named after their md5, pools put "<number> - " in front.
+# Never matches a .part file.
+md5_re = re.compile(r"([0-9a-f]{32})\.\w+$")
+
+
+def md5_file(path):
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest
+
+
+def find_files(root):
+    """Yield (path, md5) for every downloaded file under root."""
+    for directory, _, names in os.walk(root):
+        for name in names:
+            match = md5_re.search(name)
+            if match:
+                yield os.path.join(directory, name), match.group(1)
+
+
+def check_file(entry):
+    """Runs in a worker process, returns the path if it doesn't match."""
+    path, md5 = entry
+    try:
+        if md5_file(path).hexdigest() != md5:
+            return path
+    except OSError:
+        return path
@@ -1,29 +1,101 @@
+import asyncio
+import hashlib
+import logging
+import logging.handlers
+import os
+import random
 import re
+import sys
+import time
 import traceback
 from functools import update_wrapper
+from queue import SimpleQueue
 
 import asyncclick as click
 
+from .audit import md5_file
+from .progress import clear_line
+from .ratelimit import THROTTLED, Throttled
+from .shard import in_shard
+
 post_re = re.compile(r"e621.net\/posts\/(\d+)")
 pool_re = re.compile(r"e621.net\/pools\/(\d+)")
 
+logger = logging.getLogger("yippi_dl")
+
+PAGE_LIMIT = 320
+ID_LIMIT = 100
+# e621 ids are 32 bit integers.
+MAX_ID = 2**31 - 1
+PART_SUFFIX = ".part"
+STATE_FILE = ".yippi_dl.sqlite"
+# Sits next to a preallocated .part file until it is trimmed.
+ALLOC_SUFFIX = ".alloc"
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+ID_BUCKET = 1000
+# How many folders deep each layout puts its files.
+LAYOUT_DEPTH = {"flat": 0, "md5": 2, "id": 1}
+
 
 def echo(message):
+    clear_line()
     click.echo("[INFO] " + str(message))
 
 
 def error(message):
+    clear_line()
     click.secho("[ERR] " + str(message), fg="red")
 
 
 def warning(message):
+    clear_line()
     click.secho("[WARN] " + str(message), fg="yellow")
 
 
-def verbose(message):
-    ctx = click.get_current_context()
-    if ctx.obj["verbose"]:
-        click.secho("[VERB] " + str(message), fg="blue")
+def verbose(message, *args):
+    # Formatting is deferred to logging, so disabled diagnostics cost a
+    # single level check.
+    logger.debug(message, *args)
+
+
+class ClickHandler(logging.Handler):
+    def emit(self, record):
+        try:
+            clear_line()
+            click.secho(self.format(record), fg="blue")
+        except Exception:
+            self.handleError(record)
+
+
+def setup_logging(v, log_file=None):
+    """Route diagnostics through a queue drained by a background thread.
+
+    Returns the listener, which has to be stopped to flush the queue.
+    """
+    handlers = []
+    if v:
+        handler = ClickHandler()
+        handler.setFormatter(logging.Formatter("[VERB] %(message)s"))
+        handlers.append(handler)
+    if log_file:
+        handler = logging.FileHandler(log_file)
+        handler.setFormatter(
+            logging.Formatter("%(asctime)s %(levelname)s %(message)s")
+        )
+        handlers.append(handler)
+
+    logger.propagate = False
+    if not handlers:
+        logger.setLevel(logging.WARNING)
+        return
+
+    logger.setLevel(logging.DEBUG)
+    log_queue = SimpleQueue()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(log_queue, *handlers)
+    listener.start()
+    return listener
 
 
 def get_post_id(string):
@@ -56,6 +128,7 @@ def print_post(post):
     tags = []
     for key in post.tags:
         tags.extend(post.tags[key])
+    clear_line()
     click.echo("Post ID: " + str(post.id))
     click.echo("Date posted: " + post.created_at)
     click.echo("Score: " + str(post.score))
@@ -66,6 +139,12 @@ def print_post(post):
     click.echo("==================")
 
 
+def is_complete(response, size):
+    # A 416 reply carries the full length as "bytes */<length>".
+    content_range = response.headers.get("Content-Range", "")
+    return size > 0 and content_range == f"bytes */{size}"
+
+
 def ask_skip(image_path):
     while True:
         click.echo(
@@ -111,66 +190,665 @@ def common_decorator(f):
     return update_wrapper(new_func, f)
 
 
-async def download_worker(ctx, session, bar, queue):
-    while True:
-        url, target, post = await queue.get()
-        verbose(f"Get work with variables: {url}, {target}, {post}")
-        verbose("Start download")
-        async with session.get(url) as r:
-            r.raise_for_status()
+def layout_dir(layout, post):
+    if layout == "md5":
+        md5 = post.file["md5"]
+        return os.path.join(md5[:2], md5[2:4])
+    if layout == "id":
+        return str(post.id // ID_BUCKET)
+    return ""
 
-            try:
-                if not ctx.obj["banner_printed"]:
-                    print_post(post)
-            except Exception as err:
-                # fmt: off
-                if ctx.obj["verbose"]:
-                    traceback.print_exception(
-                        type(err), err, err.__traceback__
-                    )
-                # fmt: on
-                error(f"An exception has occured: `{err.__class__.__name__}`")
 
-            verbose("Opening target: " + str(target))
-            with open(target, "wb") as f:
-                try:
-                    while True:
-                        chunk = await r.content.read(1024)
-                        if not chunk:
-                            break
-                        f.write(chunk)
-                except Exception as err:
-                    # fmt: off
-                    if ctx.obj["verbose"]:
-                        traceback.print_exception(
-                            type(err), err, err.__traceback__
-                        )
-
-                    error(
-                        f"An exception has occured: `{err.__class__.__name__}`"
+def scan_tree(path, depth):
+    """Every file under path, relative to it, up to depth folders down."""
+    found = set()
+
+    def scan(directory, prefix, depth):
+        try:
+            entries = os.scandir(directory)
+        except FileNotFoundError:
+            return
+        with entries:
+            for entry in entries:
+                name = os.path.join(prefix, entry.name)
+                if not entry.is_dir():
+                    found.add(name)
+                elif depth:
+                    scan(entry.path, name, depth - 1)
+
+    scan(path, "", depth)
+    return found
+
+
+def open_part(path, offset):
+    if not offset:
+        return open(path, "wb")
+    f = open(path, "r+b")
+    f.seek(offset)
+    return f
+
+
+def preallocate(f, size, marker):
+    if not hasattr(os, "posix_fallocate"):
+        return
+    # Marked first, a hard kill from here on leaves a full length file
+    # that says nothing about how much was written.
+    open(marker, "w").close()
+    try:
+        os.posix_fallocate(f.fileno(), 0, size)
+    except OSError:
+        # Not supported by the filesystem, just write normally.
+        pass
+
+
+def close_part(f, marker):
+    # Drop the preallocated tail, the .part size is where a resumed
+    # download picks up.
+    f.truncate(f.tell())
+    f.close()
+    if os.path.exists(marker):
+        os.remove(marker)
+
+
+def write_chunks(f, chunks, digest=None):
+    data = b"".join(chunks)
+    f.write(data)
+    if digest:
+        digest.update(data)
+
+
+class ChecksumMismatch(Exception):
+    pass
+
+
+def check_md5(part, digest, md5):
+    if digest.hexdigest() == md5:
+        return
+    # Whatever is on disk is bad, so the retry starts from scratch.
+    os.remove(part)
+    raise ChecksumMismatch(f"{part} doesn't match md5 {md5}")
+
+
+class Download:
+    def __init__(self, url, target, post, type, archive=None, number=None):
+        self.url = url
+        self.target = target
+        self.post = post
+        self.type = type
+        self.archive = archive
+        self.number = number
+        # Samples and previews don't list a size, the original's is close
+        # enough to rank them.
+        meta = getattr(post, type)
+        self.size = meta.get("size") or post.file.get("size") or 0
+        self.attempts = 0
+        self.started = None
+        self.record = {"post": post.id, "url": url, "bytes": 0}
+
+    def __repr__(self):
+        return f"Download({self.url}, {self.target}, {self.post})"
+
+
+async def fetch_file(ctx, session, item, bar):
+    url = item.url
+    post = item.post
+    record = item.record
+    loop = asyncio.get_event_loop()
+    executor = ctx.obj["executor"]
+    # Only originals are listed with their md5.
+    md5 = post.file.get("md5") if item.type == "file" else None
+    # Bytes land in a .part file first, so an interrupted transfer is
+    # never mistaken for a finished one and can be resumed later.
+    part = item.target + PART_SUFFIX
+    marker = part + ALLOC_SUFFIX
+    headers = {}
+    offset = 0
+    if os.path.exists(marker):
+        verbose("Discarding %s, it was never trimmed.", part)
+        if os.path.exists(part):
+            os.remove(part)
+        os.remove(marker)
+    if os.path.exists(part):
+        offset = os.path.getsize(part)
+        headers["Range"] = f"bytes={offset}-"
+        verbose("Resuming %s from byte %d", part, offset)
+
+    verbose("Start download")
+    started = time.monotonic()
+    r = await session.get(url, headers=headers)
+    if r.status == 416 and offset and not is_complete(r, offset):
+        # Longer than the file itself, so none of it can be trusted.
+        r.release()
+        warning(f"Warning: {part} doesn't fit the file, starting over.")
+        os.remove(part)
+        offset = 0
+        r = await session.get(url)
+    async with r:
+        record["status"] = r.status
+        record["ttfb"] = time.monotonic() - started
+        if r.status in THROTTLED:
+            raise Throttled(f"{url} answered with HTTP {r.status}")
+
+        if r.status == 416 and is_complete(r, offset):
+            verbose("Partial file is already complete.")
+            if md5:
+                digest = await loop.run_in_executor(executor, md5_file, part)
+                check_md5(part, digest, md5)
+            return
+
+        r.raise_for_status()
+        if r.status != 206:
+            offset = 0
+
+        digest = None
+        if md5 and offset:
+            # Picks up where the bytes already on disk leave off.
+            digest = await loop.run_in_executor(executor, md5_file, part)
+        elif md5:
+            digest = hashlib.md5()
+
+        try:
+            if ctx.obj["print_posts"] and not ctx.obj["banner_printed"]:
+                print_post(post)
+        except Exception as err:
+            if ctx.obj["verbose"]:
+                traceback.print_exception(type(err), err, err.__traceback__)
+            error(f"An exception has occured: `{err.__class__.__name__}`")
+
+        # Disk work runs on the I/O threads so a slow disk doesn't stall
+        # every other transfer on the event loop.
+        verbose("Opening target: %s", part)
+        chunk_size = ctx.obj["chunk_size"]
+        f = await loop.run_in_executor(executor, open_part, part, offset)
+        # Shielded, so a cancelled transfer still knows when the I/O
+        # thread is done with the file.
+        io = None
+        try:
+            bar.active += 1
+            if ctx.obj["preallocate"] and r.content_length:
+                size = offset + r.content_length
+                io = loop.run_in_executor(
+                    executor, preallocate, f, size, marker
+                )
+                await asyncio.shield(io)
+
+            chunks = []
+            buffered = 0
+            async for chunk in r.content.iter_chunked(chunk_size):
+                chunks.append(chunk)
+                buffered += len(chunk)
+                record["bytes"] += len(chunk)
+                bar.advance(len(chunk))
+                if buffered >= chunk_size:
+                    io = loop.run_in_executor(
+                        executor, write_chunks, f, chunks, digest
                     )
-                    # fmt: on
+                    await asyncio.shield(io)
+                    chunks = []
+                    buffered = 0
+            if chunks:
+                io = loop.run_in_executor(
+                    executor, write_chunks, f, chunks, digest
+                )
+                await asyncio.shield(io)
+        finally:
+            bar.active -= 1
+            if io:
+                await asyncio.wait([io])
+            await loop.run_in_executor(executor, close_part, f, marker)
+
+        if digest:
+            check_md5(part, digest, md5)
+
+
+async def fetch_to_archive(ctx, session, item, bar):
+    # Pages stay in memory and go straight into the pool's archive.
+    record = item.record
+    started = time.monotonic()
+    async with session.get(item.url) as r:
+        record["status"] = r.status
+        record["ttfb"] = time.monotonic() - started
+        if r.status in THROTTLED:
+            raise Throttled(f"{item.url} answered with HTTP {r.status}")
+        r.raise_for_status()
+
+        chunks = []
+        bar.active += 1
+        try:
+            async for chunk in r.content.iter_chunked(ctx.obj["chunk_size"]):
+                chunks.append(chunk)
+                record["bytes"] += len(chunk)
+                bar.advance(len(chunk))
+        finally:
+            bar.active -= 1
+
+    data = b"".join(chunks)
+    md5 = item.post.file.get("md5") if item.type == "file" else None
+    if md5:
+        loop = asyncio.get_event_loop()
+        digest = await loop.run_in_executor(
+            ctx.obj["executor"], hashlib.md5, data
+        )
+        if digest.hexdigest() != md5:
+            raise ChecksumMismatch(f"{item.target} doesn't match md5 {md5}")
+    name = os.path.basename(item.target)
+    await item.archive.add(item.number, name, data)
+
+
+async def requeue(queue, item, delay):
+    try:
+        await asyncio.sleep(delay)
+        await queue.put(item)
+    finally:
+        queue.task_done()
+
+
+def finish(ctx, item, err=None):
+    record = item.record
+    record["retries"] = item.attempts
+    record["latency"] = time.monotonic() - item.started
+    if err:
+        # The attempt that gave up was counted but never retried.
+        record["retries"] -= 1
+        record["error"] = err.__class__.__name__
+    ctx.obj["stats"].transfer(record)
+
+
+def retry_later(ctx, bar, queue, item, err):
+    item.attempts += 1
+    if item.attempts > ctx.obj["retries"]:
+        # fmt: off
+        warning(f"Warning: Giving up on {item.target} "
+                f"after {item.attempts} attempts.")
+        # fmt: on
+        finish(ctx, item, err)
+        ctx.obj["failed"].append((item, err))
+        if item.archive:
+            item.archive.drop(item.number)
+        bar.done(item)
+        queue.task_done()
+        return
+
+    delay = min(BACKOFF_BASE * 2 ** (item.attempts - 1), BACKOFF_MAX)
+    delay *= random.uniform(0.5, 1.5)
+    warning(f"Warning: Retrying {item.target} in {delay:.1f}s.")
+
+    # The item stays unfinished until it is back in the queue, so
+    # queue.join() can't return while a retry is pending.
+    task = asyncio.create_task(requeue(queue, item, delay))
+    ctx.obj["retrying"].add(task)
+    task.add_done_callback(ctx.obj["retrying"].discard)
+
+
+async def download_worker(ctx, bar, queue):
+    limiter = ctx.obj["limiter"]
+    while True:
+        item = await queue.get()
+        session = ctx.obj["cdn_session"]
+        fetch = fetch_to_archive if item.archive else fetch_file
+        verbose("Get work: %s", item)
+        if item.started is None:
+            item.started = time.monotonic()
+
+        try:
+            try:
+                async with limiter:
+                    await fetch(ctx, session, item, bar)
+            finally:
+                queue.release(item)
+            # Still covered, a file that can't be put in place is retried
+            # and given up on like any other failure.
+            limiter.success()
+            if not item.archive:
+                os.replace(item.target + PART_SUFFIX, item.target)
+                if ctx.obj["manifest"]:
+                    ctx.obj["manifest"].add(item.post, item.type, item.target)
+            save_metadata(ctx, item.post, item.type, item.target)
+        except Throttled as err:
+            # The limiter has already backed off, the retry waits for it
+            # as well.
+            warning(f"Warning: {err}, slowing down.")
+            retry_later(ctx, bar, queue, item, err)
+            continue
+        except Exception as err:
+            if ctx.obj["verbose"]:
+                traceback.print_exception(type(err), err, err.__traceback__)
+            error(f"An exception has occured: `{err.__class__.__name__}`")
+            retry_later(ctx, bar, queue, item, err)
+            continue
+
+        finish(ctx, item)
 
         verbose("Done. Updating bar and marking as done.")
-        bar.update(1)
+        bar.done(item)
         queue.task_done()
 
 
-async def get_post(ctx, post_id):
-    verbose("Getting post: " + str(post_id))
+def spawn_workers(ctx, jobs, bar, queue):
+    workers = set()
+
+    def respawn(task):
+        workers.discard(task)
+        if task.cancelled():
+            return
+        err = task.exception()
+        error(f"A worker has crashed: `{err.__class__.__name__}`, restarting.")
+        start()
+
+    def start():
+        task = asyncio.create_task(download_worker(ctx, bar, queue))
+        task.add_done_callback(respawn)
+        workers.add(task)
+
+    verbose("Spawning %d workers.", jobs)
+    for _ in range(jobs):
+        start()
+    return workers
+
+
+def save_metadata(ctx, post, type, path):
+    if not ctx.obj["metadata"]:
+        return
+    from .metadata import post_record
+
+    ctx.obj["metadata"].add(post_record(post, type, path))
+
+
+def report_failed(ctx):
+    failed = ctx.obj["failed"]
+    if not failed:
+        return
+    error(f"{len(failed)} file(s) could not be downloaded:")
+    for item, err in failed:
+        error(f"Post #{item.post.id}: {item.url} (`{err.__class__.__name__}`)")
+
+
+async def call_api(ctx, method, *args, **kwargs):
+    """Call a client method, trying again when the API throttled it.
+
+    yippi doesn't tell which status it got, but a throttled reply pauses
+    the token bucket, so the next try waits until the API is ready.
+    """
+    bucket = ctx.obj["api_bucket"]
+    attempt = 0
+    while True:
+        pauses = bucket.pauses
+        try:
+            return await getattr(ctx.obj["client"], method)(*args, **kwargs)
+        except Exception:
+            attempt += 1
+            if bucket.pauses == pauses or attempt > ctx.obj["retries"]:
+                raise
+            warning("Warning: The API is throttling requests, slowing down.")
+
+
+async def search_ids(ctx, post_ids):
+    verbose("Getting %d posts by id.", len(post_ids))
+    query = ["id:" + ",".join(map(str, post_ids)), "status:any"]
     try:
-        return await ctx.obj["client"].post(post_id)
+        return await call_api(ctx, "posts", query, len(post_ids))
     except Exception as err:
         if ctx.obj["verbose"]:
             traceback.print_exception(type(err), err, err.__traceback__)
         error(f"An exception has occured: `{err.__class__.__name__}`")
+        return []
+
+
+def chunked(items, size):
+    return [items[i : i + size] for i in range(0, len(items), size)]
+
+
+async def get_posts(ctx, post_ids):
+    post_ids = list(dict.fromkeys(int(post_id) for post_id in post_ids))
+    chunks = chunked(post_ids, ID_LIMIT)
+    results = await asyncio.gather(*(search_ids(ctx, c) for c in chunks))
+    found = {post.id: post for result in results for post in result}
+
+    posts = []
+    for post_id in post_ids:
+        if post_id in found:
+            posts.append(found[post_id])
+        else:
+            warning(f"Warning: Post #{post_id} was not found.")
+    return posts
+
+
+async def number_pool_posts(ctx, pool, numbers=None):
+    if numbers is None:
+        numbers = {post_id: i for i, post_id in enumerate(pool.post_ids, 1)}
+    post_ids = [post_id for post_id in numbers if in_shard(ctx, post_id)]
+    posts = await get_posts(ctx, post_ids)
+    return [(numbers[post.id], post) for post in posts]
+
+
+class IdSet:
+    """A set of post or pool ids kept as bitmaps, one bit per id.
+
+    Bitmaps cover PAGE_BITS ids each and are only made for ranges that
+    have ids in them, so far apart ids stay cheap.
+    """
+
+    PAGE_BITS = 2**16
+
+    def __init__(self):
+        self.pages = {}
+
+    def add(self, value):
+        """Add value, returning False if it was already there."""
+        page, offset = divmod(value, self.PAGE_BITS)
+        bits = self.pages.get(page)
+        if bits is None:
+            bits = self.pages[page] = bytearray(self.PAGE_BITS // 8)
+        index, bit = divmod(offset, 8)
+        if bits[index] & 1 << bit:
+            return False
+        bits[index] |= 1 << bit
+        return True
+
+
+async def read_ids(path, parse, ids=()):
+    """Yield the unique ids in ids and then in the lines of path, or of
+    stdin for "-", as they are read. Lines go through parse, so URLs work
+    as well."""
+    seen = IdSet()
+    for value in ids:
+        if not 0 < int(value) <= MAX_ID:
+            warning(f"Warning: Skipping `{value}`, it isn't a valid id.")
+        elif seen.add(int(value)):
+            yield int(value)
+
+    loop = asyncio.get_event_loop()
+    f = sys.stdin if path == "-" else open(path)
+    try:
+        while True:
+            line = await loop.run_in_executor(None, f.readline)
+            if not line:
+                break
+            value = parse(line.strip())
+            if not value or not 0 < int(value) <= MAX_ID:
+                if line.strip():
+                    warning(f"Warning: Skipping `{line.strip()}`.")
+                continue
+            if seen.add(int(value)):
+                yield int(value)
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+async def batch_ids(ids, size=ID_LIMIT, wait=1.0):
+    """Group ids into lists of up to size, without holding a partial list
+    back for more than wait seconds when the input is slow."""
+    queue = asyncio.Queue(maxsize=size)
+
+    async def pump():
+        try:
+            async for value in ids:
+                await queue.put(value)
+        except Exception:
+            # Ends the batches, the error comes out of `await reader`.
+            await queue.put(None)
+            raise
+        await queue.put(None)
+
+    reader = asyncio.create_task(pump())
+    chunk = []
+    try:
+        while True:
+            try:
+                value = await asyncio.wait_for(
+                    queue.get(), wait if chunk else None
+                )
+            except asyncio.TimeoutError:
+                yield chunk
+                chunk = []
+                continue
+            if value is None:
+                break
+            chunk.append(value)
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    finally:
+        reader.cancel()
+    await reader
+
+
+async def stream_posts(ctx, post_ids):
+    ids = (post_id async for post_id in post_ids if in_shard(ctx, post_id))
+    async for chunk in batch_ids(ids):
+        for post in await get_posts(ctx, chunk):
+            yield post
+
+
+async def stream_pools(ctx, pool_ids):
+    async for chunk in batch_ids(pool_ids):
+        for pool in await get_pools(ctx, chunk):
+            yield pool
+
+
+async def get_pool_posts(ctx, pools, plans=None):
+    # plans maps a pool id to the {post id: number} to download, the
+    # default is every post numbered by its position in the pool.
+    plans = plans or {}
+    tasks = [
+        asyncio.create_task(number_pool_posts(ctx, pool, plans.get(pool.id)))
+        for pool in pools
+    ]
+    try:
+        for task in asyncio.as_completed(tasks):
+            for entry in await task:
+                yield entry
+    finally:
+        for task in tasks:
+            task.cancel()
 
 
-async def get_pool(ctx, pool_id):
-    verbose("Getting pool: " + str(pool_id))
+async def search_pools(ctx, pool_ids):
+    verbose("Getting %d pools by id.", len(pool_ids))
     try:
-        return await ctx.obj["client"].pool(pool_id)
+        return await call_api(
+            ctx, "pools", id_=",".join(map(str, pool_ids)), limit=len(pool_ids)
+        )
     except Exception as err:
         if ctx.obj["verbose"]:
             traceback.print_exception(type(err), err, err.__traceback__)
         error(f"An exception has occured: `{err.__class__.__name__}`")
+        return []
+
+
+async def get_pools(ctx, pool_ids):
+    pool_ids = list(dict.fromkeys(int(pool_id) for pool_id in pool_ids))
+    chunks = chunked(pool_ids, ID_LIMIT)
+    results = await asyncio.gather(*(search_pools(ctx, c) for c in chunks))
+    found = {pool.id: pool for result in results for pool in result}
+
+    pools = []
+    for pool_id in pool_ids:
+        if pool_id in found:
+            pools.append(found[pool_id])
+        else:
+            warning(f"Pool #{pool_id} was not found. Skipping.")
+    return pools
+
+
+async def iterate_posts(posts):
+    if hasattr(posts, "__aiter__"):
+        async for post in posts:
+            yield post
+    else:
+        for post in posts:
+            yield post
+
+
+async def fetch_pages(ctx, query, limit, cursor, pages, status):
+    fetched = 0
+    page = None if cursor else 1
+    # Pages keep one size while paging, so their offsets line up. A limit
+    # that fits in one page is asked for as it is.
+    page_size = limit if 0 < limit < PAGE_LIMIT else PAGE_LIMIT
+    try:
+        while not limit or fetched < limit:
+            verbose("Asking page: %s | limit: %d", page, page_size)
+            try:
+                api_response = await call_api(
+                    ctx, "posts", list(query), page_size, page
+                )
+            except Exception as err:
+                if ctx.obj["verbose"]:
+                    traceback.print_exception(
+                        type(err), err, err.__traceback__
+                    )
+                error(f"An exception has occured: `{err.__class__.__name__}`")
+                status["complete"] = False
+                break
+
+            if not api_response:
+                verbose("API doesn't reply anything, stopping pagination.")
+                break
+
+            if limit:
+                api_response = api_response[: limit - fetched]
+            fetched += len(api_response)
+            await pages.put(api_response)
+
+            if len(api_response) < page_size:
+                break
+            if cursor:
+                page = "b" + str(min(post.id for post in api_response))
+            else:
+                page += 1
+    finally:
+        await pages.put(None)
+
+
+async def search_posts(
+    ctx, query, limit, cursor=False, prefetch=1, status=None
+):
+    """Yield the posts of a search. status["complete"] is set to False if
+    a page couldn't be fetched and the results stopped early."""
+    if status is None:
+        status = {}
+    status["complete"] = True
+    if cursor and any(tag.startswith("order:") for tag in query):
+        warning(
+            "Warning: Cursor pagination always walks posts by id, "
+            "`order:` tags may skip results."
+        )
+
+    verbose("Pagination start. Cursor: %s | Prefetch: %d", cursor, prefetch)
+    pages = asyncio.Queue(maxsize=max(prefetch, 1))
+    producer = asyncio.create_task(
+        fetch_pages(ctx, query, limit, cursor, pages, status)
+    )
+    try:
+        while True:
+            api_response = await pages.get()
+            if api_response is None:
+                break
+            for post in api_response:
+                yield post
+    finally:
+        producer.cancel()
@@ -1,13 +1,16 @@
+import asyncio
+import threading
+
 import asyncclick as click
 
 from .__main__ import pool, post
 from .helper import (
-    get_pool,
     get_pool_id,
-    get_post,
     get_post_id,
     print_pool,
-    print_post
+    print_post,
+    stream_pools,
+    stream_posts,
 )
 
 
@@ -15,51 +18,113 @@ def invalid_input(ctx):
     click.secho("Invalid input!")
 
 
-async def select_post(ctx):
-    click.clear()
-    click.echo("==================")
-    click.echo("  Download Posts  ")
-    click.echo("==================")
-    click.echo("")
-    click.echo("Please give me the URLs and/or post ID.")
-    click.echo("When you're done, you can give me an empty line.")
-    posts = []
+async def ask(*args, **kwargs):
+    """click.prompt without blocking the event loop, so lookups keep going
+    while the user types."""
+    loop = asyncio.get_event_loop()
+    future = loop.create_future()
+
+    def settle(method, value):
+        if not future.done():
+            method(value)
+
+    def run():
+        try:
+            value = click.prompt(*args, **kwargs)
+        except BaseException as err:
+            loop.call_soon_threadsafe(settle, future.set_exception, err)
+        else:
+            loop.call_soon_threadsafe(settle, future.set_result, value)
+
+    # A daemon thread, so quitting doesn't wait for a pending prompt.
+    threading.Thread(target=run, daemon=True).start()
+    return await future
+
+
+async def drain(queue):
+    while True:
+        item = await queue.get()
+        if item is None:
+            return
+        yield item
+
+
+async def look_up(ctx, fetch, show, ids, results):
+    """Resolve ids as they are entered, showing each result when ready."""
+    try:
+        async for obj in fetch(ctx, drain(ids)):
+            show(obj)
+            await results.put(obj)
+    finally:
+        await results.put(None)
+
+
+async def prompt_ids(ctx, parse, fetch, show, kind):
+    """Prompt for ids, looking them up in the background."""
+    ids = asyncio.Queue()
+    results = asyncio.Queue()
+    lookup = asyncio.create_task(look_up(ctx, fetch, show, ids, results))
+    count = 0
     while True:
         # fmt: off
-        response = click.prompt(
+        response = await ask(
             "", prompt_suffix="> ", default="", show_default=False
         )
         # fmt: on
         if not response or not response.strip():
+            if not count and kind == "pool":
+                continue
             break
 
-        post_id = get_post_id(response)
-        if not post_id:
-            click.secho("Please send valid URL or post ID!")
+        value = parse(response.strip())
+        if not value:
+            click.secho(f"Please send valid URL or {kind} ID!")
             continue
+        count += 1
+        await ids.put(int(value))
+    await ids.put(None)
+    return lookup, results, count
 
-        obj = await get_post(ctx, post_id)
-        if obj:
-            print_post(obj)
-            posts.append(obj)
 
-    output = click.prompt(
+async def ask_options():
+    output = await ask(
         "Where will the images be saved? ", type=click.Path(), default="."
     )
-    jobs = click.prompt(
+    jobs = await ask(
         "How many concurrent jobs will be done? "
         "(If you don't know what that means, just leave it as is.)",
         type=int,
         default=4,
     )
-    type_ = click.prompt(
+    type_ = await ask(
         "Which quality do you want to download? ",
         type=click.Choice(["sample", "file", "preview"]),
         default="file",
     )
+    return output, jobs, type_
+
+
+async def select_post(ctx):
+    click.clear()
+    click.echo("==================")
+    click.echo("  Download Posts  ")
+    click.echo("==================")
+    click.echo("")
+    click.echo("Please give me the URLs and/or post ID.")
+    click.echo("When you're done, you can give me an empty line.")
+    lookup, results, count = await prompt_ids(
+        ctx, get_post_id, stream_posts, print_post, "post"
+    )
+
+    # Posts still being looked up go to the download as they arrive.
+    output, jobs, type_ = await ask_options()
+    # fmt: off
     await ctx.invoke(
-        post, post_id=-1, output=output, jobs=jobs, posts=posts, type=type_
+        post, post_id=-1, output=output, jobs=jobs, posts=drain(results),
+        type=type_, total=count,
     )
+    # fmt: on
+    await lookup
 
 
 async def select_pool(ctx):
@@ -70,44 +135,16 @@ async def select_pool(ctx):
     click.echo("")
     click.echo("Please give me the URLs and/or pool ID.")
     click.echo("When you're done, you can give me an empty line.")
-    pools = []
-    while True:
-        # fmt: off
-        response = click.prompt(
-            "", prompt_suffix="> ", default="", show_default=False
-        )
-        # fmt: on
-        if not response or not response.strip():
-            if not pools:
-                continue
-            break
-
-        pool_id = get_pool_id(response)
-        if not pool_id:
-            click.secho("Please send valid URL or pool ID!")
-            continue
-
-        obj = await get_pool(ctx, pool_id)
-        if obj:
-            print_pool(obj)
-            pools.append(obj)  # noqa
-        else:
-            click.secho(f'Pool "{pool_id}" was not found.')  # noqa
-
-    output = click.prompt(
-        "Where will the images be saved? ", type=click.Path(), default="."
-    )
-    jobs = click.prompt(
-        "How many concurrent jobs will be done? "
-        "(If you don't know what that means, just leave it as is.)",
-        type=int,
-        default=4,
-    )
-    type_ = click.prompt(
-        "Which quality do you want to download? ",
-        type=click.Choice(["sample", "file", "preview"]),
-        default="file",
+    lookup, results, _ = await prompt_ids(
+        ctx, get_pool_id, stream_pools, print_pool, "pool"
     )
+
+    output, jobs, type_ = await ask_options()
+    pools = [obj async for obj in drain(results)]
+    await lookup
+    if not pools:
+        click.secho("None of the pools were found.")
+        return
     await ctx.invoke(
         pool, pool_id=-1, output=output, jobs=jobs, type=type_, pools=pools
     )
@@ -0,0 +1,71 @@
+import os
+import shutil
+import sqlite3
+
+COMMIT_EVERY = 100
+
+
+class Manifest:
+    """An on-disk index of every file that has been downloaded.
+
+    Files are keyed by post id, md5 and quality, so the same content can be
+    found again no matter which directory or pool numbering it was saved
+    under.
+    """
+
+    def __init__(self, path, commit_every=COMMIT_EVERY):
+        self.path = path
+        self.pending = 0
+        self.commit_every = commit_every
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, post_id INTEGER, md5 TEXT, type TEXT)"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS files_md5 ON files (md5, type)"
+        )
+        self.conn.commit()
+
+    def find(self, post, type):
+        md5 = post.file.get("md5")
+        cursor = self.conn.execute(
+            "SELECT path FROM files WHERE (md5 = ? OR post_id = ?) "
+            "AND type = ?",
+            (md5, post.id, type),
+        )
+        for (path,) in cursor:
+            if os.path.exists(path):
+                return path
+
+    def types(self):
+        """The quality of every file, keyed by its absolute path."""
+        return dict(self.conn.execute("SELECT path, type FROM files"))
+
+    def add(self, post, type, path):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+            (os.path.abspath(path), post.id, post.file.get("md5"), type),
+        )
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.commit()
+
+    def commit(self):
+        self.conn.commit()
+        self.pending = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+
+def reuse_file(source, target, mode):
+    if mode == "link":
+        try:
+            os.link(source, target)
+            return
+        except OSError:
+            # Different filesystem or no hardlink support, copy instead.
+            pass
+    shutil.copy2(source, target)
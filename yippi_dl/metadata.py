@@ -0,0 +1,103 @@
+import json
+import os
+import sqlite3
+
+FLUSH_EVERY = 100
+SQLITE_SUFFIXES = (".sqlite", ".sqlite3", ".db")
+
+
+def post_record(post, type, path):
+    meta = getattr(post, type)
+    return {
+        "id": post.id,
+        "path": os.path.abspath(path),
+        "type": type,
+        "md5": post.file.get("md5"),
+        "ext": post.file.get("ext"),
+        "size": post.file.get("size"),
+        "width": meta.get("width"),
+        "height": meta.get("height"),
+        "url": meta.get("url"),
+        "created_at": post.created_at,
+        "updated_at": post.updated_at,
+        "rating": post.rating.name.lower(),
+        "score": post.score.get("total"),
+        "fav_count": post.fav_count,
+        "tags": post.tags,
+        "sources": post.sources,
+        "pools": post.pools,
+        "description": post.description,
+    }
+
+
+class JsonSink:
+    """Appends one JSON object per line."""
+
+    def __init__(self, path):
+        self.file = open(path, "a", encoding="utf-8")
+        self.buffer = []
+
+    def add(self, record):
+        self.buffer.append(json.dumps(record, ensure_ascii=False) + "\n")
+        if len(self.buffer) >= FLUSH_EVERY:
+            self.flush()
+
+    def flush(self):
+        self.file.write("".join(self.buffer))
+        self.file.flush()
+        self.buffer.clear()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class SqliteSink:
+    """Keeps the latest record of every post in a `posts` table."""
+
+    def __init__(self, path):
+        self.buffer = []
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS posts ("
+            "post_id INTEGER, type TEXT, path TEXT, md5 TEXT, rating TEXT, "
+            "score INTEGER, created_at TEXT, tags TEXT, data TEXT, "
+            "PRIMARY KEY (post_id, type))"
+        )
+        self.conn.commit()
+
+    def add(self, record):
+        tags = [tag for group in record["tags"].values() for tag in group]
+        self.buffer.append(
+            (
+                record["id"],
+                record["type"],
+                record["path"],
+                record["md5"],
+                record["rating"],
+                record["score"],
+                record["created_at"],
+                " ".join(tags),
+                json.dumps(record, ensure_ascii=False),
+            )
+        )
+        if len(self.buffer) >= FLUSH_EVERY:
+            self.flush()
+
+    def flush(self):
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO posts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            self.buffer,
+        )
+        self.conn.commit()
+        self.buffer.clear()
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+
+def open_sink(path):
+    if path.endswith(SQLITE_SUFFIXES):
+        return SqliteSink(path)
+    return JsonSink(path)
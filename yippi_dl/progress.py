@@ -0,0 +1,134 @@
+import asyncio
+import sys
+import time
+from collections import deque
+
+import asyncclick as click
+
+TTY_INTERVAL = 0.1
+LOG_INTERVAL = 10.0
+RATE_WINDOW = 5.0
+
+current = None
+
+
+def clear_line():
+    # Called before other output, the next redraw puts the bar back.
+    if current and current.tty:
+        click.echo("\r\x1b[K", nl=False)
+
+
+def format_bytes(size):
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024 or unit == "GiB":
+            return f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def format_eta(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02}:{seconds:02}"
+
+
+class Progress:
+    """Counts files and bytes, and redraws at a fixed rate.
+
+    Updates only bump counters, so they cost the same no matter how many
+    workers send them. When stdout isn't a terminal a summary line is
+    printed every LOG_INTERVAL seconds instead.
+    """
+
+    def __init__(self, total, label="Downloading posts..."):
+        self.total = total
+        self.label = label
+        self.files = 0
+        self.bytes = 0
+        self.queued = 0
+        self.queued_bytes = 0
+        self.outstanding = 0
+        self.outstanding_bytes = 0
+        self.active = 0
+        self.samples = deque()
+        self.tty = sys.stdout.isatty()
+        self.started = time.monotonic()
+        self.task = None
+
+    def __enter__(self):
+        global current
+        current = self
+        self.task = asyncio.ensure_future(self.run())
+        return self
+
+    def __exit__(self, *exc):
+        global current
+        self.task.cancel()
+        self.render(final=True)
+        current = None
+
+    async def run(self):
+        interval = TTY_INTERVAL if self.tty else LOG_INTERVAL
+        while True:
+            await asyncio.sleep(interval)
+            self.render()
+
+    def update(self, files):
+        """Count files that never needed downloading."""
+        self.files += files
+
+    def add(self, item):
+        self.queued += 1
+        self.queued_bytes += item.size
+        self.outstanding += 1
+        self.outstanding_bytes += item.size
+
+    def done(self, item):
+        self.files += 1
+        self.outstanding -= 1
+        self.outstanding_bytes -= item.size
+
+    def advance(self, size):
+        self.bytes += size
+
+    def rate(self):
+        now = time.monotonic()
+        self.samples.append((now, self.bytes))
+        # Keep one sample older than the window to measure from.
+        samples = self.samples
+        while len(samples) > 1 and now - samples[1][0] > RATE_WINDOW:
+            samples.popleft()
+        then, size = samples[0]
+        if now - then < 0.5:
+            then, size = self.started, 0
+        return (self.bytes - size) / max(now - then, 1e-6)
+
+    def eta(self, rate):
+        if not rate or not self.queued:
+            return None
+        # Files that haven't been queued yet are guessed at the average
+        # size of the ones that have.
+        unseen = max(self.total - self.files - self.outstanding, 0)
+        average = self.queued_bytes / self.queued
+        return (self.outstanding_bytes + unseen * average) / rate
+
+    def line(self):
+        rate = self.rate()
+        parts = [
+            self.label,
+            f"{self.files}/{self.total or '?'} files",
+            format_bytes(self.bytes),
+            f"{format_bytes(rate)}/s",
+        ]
+        if self.active:
+            each = format_bytes(rate / self.active)
+            parts.append(f"{self.active} active, {each}/s each")
+        eta = self.eta(rate)
+        if eta is not None:
+            parts.append("ETA " + format_eta(eta))
+        return "  ".join(parts)
+
+    def render(self, final=False):
+        if self.tty:
+            click.echo("\r\x1b[K" + self.line(), nl=final)
+        else:
+            click.echo(self.line())
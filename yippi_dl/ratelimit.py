@@ -0,0 +1,136 @@
+import asyncio
+import time
+from email.utils import parsedate_to_datetime
+
+THROTTLED = (429, 503)
+DEFAULT_BACKOFF = 1.0
+
+
+class Throttled(Exception):
+    pass
+
+
+def retry_after(headers):
+    value = headers.get("Retry-After")
+    if not value:
+        return DEFAULT_BACKOFF
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return DEFAULT_BACKOFF
+
+
+class TokenBucket:
+    """Paces requests to a fixed rate, allowing short bursts."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        # How often the server has throttled us, so a failed call can
+        # tell whether it was one of them.
+        self.pauses = 0
+        self.lock = asyncio.Lock()
+
+    def pause(self, delay):
+        self.pauses += 1
+        self.paused_until = max(self.paused_until, time.monotonic() + delay)
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+
+                elapsed = now - self.updated
+                self.tokens = min(
+                    self.capacity, self.tokens + elapsed * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AdaptiveLimit:
+    """Caps concurrent transfers, halving on throttling and growing back
+    by one slot per window of successful transfers (AIMD)."""
+
+    def __init__(self, maximum):
+        self.maximum = maximum
+        self.limit = float(maximum)
+        self.active = 0
+        self.paused_until = 0
+        self.condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        delay = self.paused_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        async with self.condition:
+            await self.condition.wait_for(
+                lambda: self.active < int(self.limit)
+            )
+            self.active += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        async with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+    def success(self):
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def backoff(self, delay):
+        self.limit = max(1.0, self.limit / 2)
+        self.paused_until = max(self.paused_until, time.monotonic() + delay)
+
+
+def make_trace_config(obj, api=True):
+    """Paces and measures API calls, and backs off on throttling. A
+    session built with api=False only ever downloads files, even from the
+    API host."""
+    import aiohttp
+
+    def is_api(url):
+        return api and url.host == obj["api_host"]
+
+    async def on_request_start(session, context, params):
+        if is_api(params.url):
+            await obj["api_bucket"].acquire()
+        context.started = time.monotonic()
+
+    async def on_request_exception(session, context, params):
+        if is_api(params.url):
+            latency = time.monotonic() - context.started
+            obj["stats"].api_call(params.url.path, latency, None)
+
+    async def on_request_end(session, context, params):
+        if is_api(params.url):
+            latency = time.monotonic() - context.started
+            status = params.response.status
+            obj["stats"].api_call(params.url.path, latency, status)
+
+        if params.response.status not in THROTTLED:
+            return
+
+        delay = retry_after(params.response.headers)
+        if is_api(params.url):
+            obj["api_bucket"].pause(delay)
+        elif obj.get("limiter"):
+            obj["limiter"].backoff(delay)
+
+    config = aiohttp.TraceConfig()
+    config.on_request_start.append(on_request_start)
+    config.on_request_end.append(on_request_end)
+    config.on_request_exception.append(on_request_exception)
+    return config
@@ -0,0 +1,91 @@
+import asyncio
+import heapq
+import itertools
+
+ORDERS = ("api", "largest", "smallest")
+# Files held back to be sorted when an order is picked.
+ORDER_WINDOW = 1000
+
+
+class SizeQueue:
+    """The download queue, handing out files by their size.
+
+    Works like asyncio.Queue, except that get() passes over large files
+    while ``large_jobs`` of them are already downloading, so a few huge
+    files can't tie up every worker. Workers call release() once they
+    stop working on an item, whatever the outcome.
+    """
+
+    def __init__(self, maxsize=0, order="api", large_size=0, large_jobs=0):
+        self.maxsize = maxsize
+        self.order = order
+        self.large_size = large_size
+        self.large_jobs = large_jobs
+        self.small = []
+        self.large = []
+        self.running = set()
+        self.counter = itertools.count()
+        self.unfinished = 0
+        self.changed = asyncio.Event()
+        self.finished = asyncio.Event()
+        self.finished.set()
+
+    def __len__(self):
+        return len(self.small) + len(self.large)
+
+    def key(self, item):
+        if self.order == "largest":
+            return -item.size
+        if self.order == "smallest":
+            return item.size
+        return 0
+
+    def is_large(self, item):
+        return self.large_jobs and item.size >= self.large_size
+
+    def heads(self):
+        heads = [self.small] if self.small else []
+        if self.large and len(self.running) < self.large_jobs:
+            heads.append(self.large)
+        return heads
+
+    async def wait(self, ready):
+        # Everything runs on one loop, so nothing can change between the
+        # check and the clear.
+        while not ready():
+            self.changed.clear()
+            await self.changed.wait()
+
+    async def put(self, item):
+        large = self.is_large(item)
+        heap = self.large if large else self.small
+        # Large files held back have a bound of their own, so a run of them
+        # can't keep small files from reaching idle workers.
+        bound = max(self.maxsize, ORDER_WINDOW) if large else self.maxsize
+        await self.wait(lambda: not self.maxsize or len(heap) < bound)
+        heapq.heappush(heap, (self.key(item), next(self.counter), item))
+        self.unfinished += 1
+        self.finished.clear()
+        self.changed.set()
+
+    async def get(self):
+        await self.wait(self.heads)
+        heap = min(self.heads(), key=lambda heap: heap[0][:2])
+        _, _, item = heapq.heappop(heap)
+        if heap is self.large:
+            self.running.add(item)
+        self.changed.set()
+        return item
+
+    def release(self, item):
+        if item in self.running:
+            self.running.discard(item)
+            self.changed.set()
+
+    def task_done(self):
+        self.unfinished -= 1
+        if not self.unfinished:
+            self.finished.set()
+
+    async def join(self):
+        await self.finished.wait()
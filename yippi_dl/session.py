@@ -0,0 +1,81 @@
+from .ratelimit import make_trace_config
+
+E621_URL = "https://e621.net"
+# API calls are paced to a few per second, they never need many sockets.
+API_CONNECTIONS = 4
+
+
+class RedirectSession:
+    """Sends requests meant for e621.net to another server instead.
+
+    Only used to point the downloader at a local stand-in, e.g. for the
+    benchmarks. Everything else is handed to the wrapped session.
+    """
+
+    def __init__(self, session, base_url):
+        self._session = session
+        self.base_url = base_url.rstrip("/")
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+    def _rewrite(self, url):
+        url = str(url)
+        if url.startswith(E621_URL):
+            url = self.base_url + url[len(E621_URL) :]
+        return url
+
+    def request(self, method, url, **kwargs):
+        return self._session.request(method, self._rewrite(url), **kwargs)
+
+    def get(self, url, **kwargs):
+        return self._session.get(self._rewrite(url), **kwargs)
+
+
+def make_connector(obj, limit):
+    import aiohttp
+
+    options = obj["connector"]
+    return aiohttp.TCPConnector(
+        limit=limit,
+        limit_per_host=options["per_host"],
+        keepalive_timeout=options["keepalive"],
+        ttl_dns_cache=options["dns_ttl"],
+    )
+
+
+def make_session(obj, base_url=None):
+    import aiohttp
+    from yarl import URL
+
+    obj["api_host"] = URL(base_url or E621_URL).host
+    limit = obj["connector"]["limit"]
+    if obj["connector"]["separate_cdn"]:
+        limit = API_CONNECTIONS
+    session = aiohttp.ClientSession(
+        connector=make_connector(obj, limit),
+        trace_configs=[make_trace_config(obj)],
+    )
+    if base_url:
+        return RedirectSession(session, base_url)
+    return session
+
+
+def make_cdn_session(obj):
+    """The session files are downloaded with, its own connection pool
+    unless --shared-session is used."""
+    if not obj["connector"]["separate_cdn"]:
+        return obj["session"]
+
+    import aiohttp
+
+    return aiohttp.ClientSession(
+        connector=make_connector(obj, obj["connector"]["limit"]),
+        trace_configs=[make_trace_config(obj, api=False)],
+    )
+
+
+def make_client(session):
+    from yippi import AsyncYippiClient
+
+    return AsyncYippiClient("yippi_dl", "0.1.0", "Error-", session)
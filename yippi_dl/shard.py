@@ -0,0 +1,84 @@
+import asyncio
+import os
+import sys
+
+import asyncclick as click
+
+# Global options the coordinator sets per process instead of copying.
+PER_SHARD = ("shard", "api_rate", "stats", "log_file")
+
+
+def parse_shard(ctx, param, value):
+    if not value:
+        return None
+    try:
+        index, count = map(int, value.split("/"))
+    except ValueError:
+        raise click.BadParameter("expected INDEX/COUNT, e.g. 0/4")
+    if not 0 <= index < count:
+        raise click.BadParameter("INDEX has to be between 0 and COUNT - 1")
+    return index, count
+
+
+def in_shard(ctx, post_id):
+    shard = ctx.obj["shard"]
+    return not shard or post_id % shard[1] == shard[0]
+
+
+def shard_total(ctx, total):
+    # Searches are not split up front, roughly 1/COUNT of them is ours.
+    shard = ctx.obj["shard"]
+    if not shard or not total:
+        return total
+    return -(-total // shard[1])
+
+
+def executable():
+    # A frozen build is its own interpreter and entry point.
+    if getattr(sys, "frozen", False):
+        return [sys.executable]
+    return [sys.executable, "-m", "yippi_dl"]
+
+
+def forward_options(ctx):
+    """Rebuild the global options the main command was given."""
+    args = []
+    for param in ctx.command.params:
+        value = ctx.params.get(param.name)
+        if param.name in PER_SHARD or value in (None, param.default):
+            continue
+        if getattr(param, "is_flag", False):
+            opts = param.opts if value else param.secondary_opts
+            args.append(opts[-1])
+        else:
+            args.extend([param.opts[-1], str(value)])
+    return args
+
+
+async def run_shard(ctx, index, count, args, stats_path):
+    main = ctx.parent
+    # fmt: off
+    argv = [
+        *executable(), *forward_options(main),
+        "--shard", f"{index}/{count}",
+        "--api-rate", str(main.params["api_rate"] / count),
+        "--stats", stats_path,
+    ]
+    # fmt: on
+    if main.params["log_file"]:
+        argv.extend(["--log-file", f"{main.params['log_file']}.{index}"])
+    argv.extend(args)
+
+    process = await asyncio.create_subprocess_exec(
+        *argv,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+        env=dict(os.environ, PYTHONUNBUFFERED="1"),
+    )
+    prefix = f"[{index}/{count}] "
+    async for line in process.stdout:
+        line = line.decode(errors="replace").rstrip()
+        if line:
+            click.echo(prefix + line)
+    return await process.wait()
@@ -0,0 +1,99 @@
+import sqlite3
+
+
+def query_key(query):
+    return " ".join(sorted(query))
+
+
+class State:
+    """Remembers what previous syncs have already seen."""
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS queries ("
+            "query TEXT PRIMARY KEY, last_id INTEGER)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS pools ("
+            "pool_id INTEGER PRIMARY KEY, post_count INTEGER, updated_at TEXT)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS pool_posts ("
+            "pool_id INTEGER, post_id INTEGER, number INTEGER, done INTEGER, "
+            "PRIMARY KEY (pool_id, post_id))"
+        )
+        self.conn.commit()
+
+    def last_id(self, query):
+        row = self.conn.execute(
+            "SELECT last_id FROM queries WHERE query = ?", (query_key(query),)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def set_last_id(self, query, last_id):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO queries VALUES (?, ?)",
+            (query_key(query), last_id),
+        )
+        self.conn.commit()
+
+    def plan_pool(self, pool):
+        """Number new posts of a pool and return what still needs
+        downloading as {post id: number}, empty if nothing changed."""
+        # Shards of the same run plan the same pools, take the write lock
+        # up front so they agree on the numbers.
+        self.conn.execute("BEGIN IMMEDIATE")
+        row = self.conn.execute(
+            "SELECT post_count, updated_at FROM pools WHERE pool_id = ?",
+            (pool.id,),
+        ).fetchone()
+        numbers = {}
+        pending = set()
+        for post_id, number, done in self.conn.execute(
+            "SELECT post_id, number, done FROM pool_posts WHERE pool_id = ?",
+            (pool.id,),
+        ):
+            numbers[post_id] = number
+            if not done:
+                pending.add(post_id)
+
+        if row == (pool.post_count, pool.updated_at) and not pending:
+            self.conn.commit()
+            return {}
+
+        # Known posts keep their number, new ones are appended after them.
+        next_number = max(numbers.values(), default=0) + 1
+        for post_id in pool.post_ids:
+            if post_id in numbers:
+                continue
+            numbers[post_id] = next_number
+            pending.add(post_id)
+            self.conn.execute(
+                "INSERT INTO pool_posts VALUES (?, ?, ?, 0)",
+                (pool.id, post_id, next_number),
+            )
+            next_number += 1
+        self.conn.commit()
+
+        return {
+            post_id: numbers[post_id]
+            for post_id in pool.post_ids
+            if post_id in pending
+        }
+
+    def finish_pool(self, pool, done):
+        self.conn.executemany(
+            "UPDATE pool_posts SET done = 1 "
+            "WHERE pool_id = ? AND post_id = ?",
+            [(pool.id, post_id) for post_id in done],
+        )
+        self.conn.execute(
+            "INSERT OR REPLACE INTO pools VALUES (?, ?, ?)",
+            (pool.id, pool.post_count, pool.updated_at),
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,124 @@
+import json
+import os
+import re
+import time
+from collections import Counter, defaultdict
+
+QUANTILES = (0.5, 0.9, 0.99)
+id_re = re.compile(r"/\d+(?=[/.]|$)")
+
+
+def endpoint(path):
+    return id_re.sub("/:id", path)
+
+
+def quantile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+def describe(values):
+    result = {"count": len(values), "sum": sum(values)}
+    for q in QUANTILES:
+        result[f"p{int(q * 100)}"] = quantile(values, q)
+    return result
+
+
+class Stats:
+    def __init__(self):
+        self.started = time.time()
+        self.transfers = []
+        self.api = defaultdict(list)
+        self.api_errors = Counter()
+
+    def transfer(self, record):
+        self.transfers.append(record)
+
+    def api_call(self, path, latency, status):
+        name = endpoint(path)
+        self.api[name].append(latency)
+        if not status or status >= 400:
+            self.api_errors[name] += 1
+
+    def merge(self, summary):
+        """Fold in the summary written by another process."""
+        self.started = min(self.started, summary["started"])
+        self.transfers.extend(summary["transfers"])
+        for name, values in summary["api_latencies"].items():
+            self.api[name].extend(values)
+            self.api_errors[name] += summary["api"][name]["errors"]
+
+    def summary(self):
+        done = [t for t in self.transfers if not t.get("error")]
+        elapsed = time.time() - self.started
+        size = sum(t["bytes"] for t in self.transfers)
+        return {
+            "started": self.started,
+            "elapsed": elapsed,
+            "files": {
+                "ok": len(done),
+                "failed": len(self.transfers) - len(done),
+                "bytes": size,
+                "bytes_per_second": size / elapsed if elapsed else 0.0,
+                "retries": sum(t["retries"] for t in self.transfers),
+                # Transfers that failed before a response have no status.
+                "status": Counter(
+                    str(t.get("status", "none")) for t in self.transfers
+                ),
+                "ttfb": describe([t["ttfb"] for t in done]),
+                "latency": describe([t["latency"] for t in done]),
+            },
+            "api": {
+                name: dict(describe(values), errors=self.api_errors[name])
+                for name, values in self.api.items()
+            },
+            "transfers": self.transfers,
+            "api_latencies": self.api,
+        }
+
+    def prometheus(self):
+        summary = self.summary()
+        files = summary["files"]
+        lines = [
+            f"yippi_dl_run_seconds {summary['elapsed']}",
+            f'yippi_dl_files_total{{result="ok"}} {files["ok"]}',
+            f'yippi_dl_files_total{{result="failed"}} {files["failed"]}',
+            f"yippi_dl_bytes_total {files['bytes']}",
+            f"yippi_dl_retries_total {files['retries']}",
+        ]
+        for status, count in sorted(files["status"].items()):
+            lines.append(
+                f'yippi_dl_http_responses_total{{status="{status}"}} {count}'
+            )
+
+        def add_summary(name, values, labels=""):
+            for q in QUANTILES:
+                value = values[f"p{int(q * 100)}"]
+                sep = "," if labels else ""
+                lines.append(f'{name}{{{labels}{sep}quantile="{q}"}} {value}')
+            suffix = f"{{{labels}}}" if labels else ""
+            lines.append(f"{name}_sum{suffix} {values['sum']}")
+            lines.append(f"{name}_count{suffix} {values['count']}")
+
+        add_summary("yippi_dl_ttfb_seconds", files["ttfb"])
+        add_summary("yippi_dl_transfer_seconds", files["latency"])
+        for name, values in sorted(summary["api"].items()):
+            labels = f'endpoint="{name}"'
+            add_summary("yippi_dl_api_request_seconds", values, labels)
+            lines.append(
+                f"yippi_dl_api_errors_total{{{labels}}} {values['errors']}"
+            )
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        # Written next to the target and renamed, so a textfile collector
+        # never reads half a file.
+        temp = path + ".tmp"
+        with open(temp, "w") as f:
+            if path.endswith(".prom"):
+                f.write(self.prometheus())
+            else:
+                json.dump(self.summary(), f, indent=2)
+        os.replace(temp, path)